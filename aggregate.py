@@ -0,0 +1,118 @@
+from typing import Iterable
+
+try:
+    from .catalogue import parse_stimulus_key
+except ImportError:
+    from catalogue import parse_stimulus_key
+
+# Per-stimulus measures: whether the genre was identified correctly (so its mean is the accuracy), then the ratings
+MEASURES = ["genre_correct", "fit", "preference", "diversity", "is_ml"]
+STATS_VAR = "rating_stats"
+
+
+class RunningStats:
+    """Count, mean and variance of a stream of values, updated one value at a time with Welford's algorithm"""
+
+    __slots__ = ("n", "mean", "m2")
+
+    def __init__(self, n: int = 0, mean: float = 0.0, m2: float = 0.0):
+        self.n, self.mean, self.m2 = n, mean, m2
+
+    def update(self, value: float) -> None:
+        self.n += 1
+        delta = value - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (value - self.mean)
+
+    def remove(self, value: float) -> None:
+        """Reverses `update` for a value that was added before, e.g. from a trial that has since failed"""
+        if self.n <= 1:
+            self.n, self.mean, self.m2 = 0, 0.0, 0.0
+            return
+        mean = (self.n * self.mean - value) / (self.n - 1)
+        self.m2 = max(self.m2 - (value - mean) * (value - self.mean), 0.0)
+        self.n, self.mean = self.n - 1, mean
+
+    def merge(self, other: "RunningStats") -> "RunningStats":
+        """Combines two sets of statistics as if all of their values had been seen by one (Chan et al.)"""
+        n = self.n + other.n
+        if n == 0:
+            return RunningStats()
+        delta = other.mean - self.mean
+        return RunningStats(
+            n,
+            self.mean + delta * other.n / n,
+            self.m2 + other.m2 + delta ** 2 * self.n * other.n / n
+        )
+
+    @property
+    def variance(self) -> float:
+        return self.m2 / (self.n - 1) if self.n > 1 else float("nan")
+
+    def to_list(self) -> list:
+        return [self.n, self.mean, self.m2]
+
+
+def rating_values(answer: dict, genre: str) -> dict:
+    """Extracts the numeric measures from a `rating` answer, skipping any question that wasn't answered"""
+    values = {}
+    for name, value in answer.items():
+        # SurveyJS matrix questions have a single unnamed row, so their answers are nested under a `null` key
+        if isinstance(value, dict):
+            value = next(iter(value.values()), None)
+        if value is None:
+            continue
+        if name == "genre":
+            values["genre_correct"] = float(value == genre)
+        elif name in MEASURES:
+            values[name] = float(value)
+    return values
+
+
+def node_stats(node) -> dict:
+    """The running statistics stored on a node, per measure"""
+    stored = node.var.get(STATS_VAR) if node.var.has(STATS_VAR) else {}
+    return {measure: RunningStats(*stored.get(measure, [])) for measure in MEASURES}
+
+
+def update_node_stats(node, answer: dict) -> None:
+    """Adds one `rating` answer to the running statistics stored on its node. Lock the node's row before calling"""
+    stats = node_stats(node)
+    genre, _, _ = parse_stimulus_key(node.definition["stimulus"])
+    for measure, value in rating_values(answer, genre).items():
+        stats[measure].update(value)
+    node.var.set(STATS_VAR, {measure: s.to_list() for measure, s in stats.items()})
+
+
+def remove_node_stats(node, answer: dict) -> None:
+    """Takes a `rating` answer back out of its node's running statistics, when its trial fails. Lock the node's row"""
+    stats = node_stats(node)
+    genre, _, _ = parse_stimulus_key(node.definition["stimulus"])
+    for measure, value in rating_values(answer, genre).items():
+        stats[measure].remove(value)
+    node.var.set(STATS_VAR, {measure: s.to_list() for measure, s in stats.items()})
+
+
+def summarise(stats: dict) -> dict:
+    """Formats statistics as n, mean and standard deviation per measure"""
+    row = {"n": max(s.n for s in stats.values())}
+    for measure, s in stats.items():
+        row[f"{measure}_mean"] = s.mean if s.n else None
+        row[f"{measure}_sd"] = s.variance ** 0.5 if s.n > 1 else None
+    return row
+
+
+def summary_tables(nodes: Iterable) -> dict:
+    """Builds per-node and per-condition summaries in one pass over the nodes, merging the node statistics"""
+    by_node, by_condition = [], {}
+    for node in nodes:
+        stats = node_stats(node)
+        genre, num, condition = parse_stimulus_key(node.definition["stimulus"])
+        by_node.append({"genre": genre, "num": num, "condition": condition, **summarise(stats)})
+        merged = by_condition.setdefault(condition, {measure: RunningStats() for measure in MEASURES})
+        for measure, s in stats.items():
+            merged[measure] = merged[measure].merge(s)
+    return {
+        "nodes": by_node,
+        "conditions": [{"condition": condition, **summarise(stats)} for condition, stats in by_condition.items()],
+    }
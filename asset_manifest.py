@@ -0,0 +1,126 @@
+import hashlib
+import json
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+
+from psynet.asset import CachedAsset, LocalStorage
+
+try:
+    from .catalogue import AUDIO_DIR
+except ImportError:
+    from catalogue import AUDIO_DIR
+
+MANIFEST_PATH = "assets/manifest.json"
+HASH_CHUNK_SIZE = 1024 * 1024
+FICLONE = 0x40049409    # Linux ioctl for copy-on-write clones on btrfs and XFS
+
+
+def md5_file(path: str) -> str:
+    """Hashes the contents of a file, in the same way that PsyNet computes cache keys for cached assets"""
+    hasher = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def load_manifest(manifest_path: str = MANIFEST_PATH) -> dict:
+    """Loads the manifest of path -> {size, mtime, digest}, or an empty manifest if none has been written yet"""
+    try:
+        with open(manifest_path, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def build_manifest(
+        audio_dir: str = AUDIO_DIR,
+        manifest_path: str = MANIFEST_PATH,
+        n_workers: int = None
+) -> dict:
+    """Updates the manifest for all renders, hashing only files whose size or modification time has changed"""
+    previous = load_manifest(manifest_path)
+    manifest, to_hash = {}, []
+    for render in sorted(i for i in os.listdir(audio_dir) if i.endswith(".mp3")):
+        path = os.path.normpath(os.path.join(audio_dir, render))
+        stat = os.stat(path)
+        entry = {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+        cached = previous.get(path)
+        if cached is not None and cached["size"] == entry["size"] and cached["mtime"] == entry["mtime"]:
+            entry["digest"] = cached["digest"]
+        else:
+            to_hash.append(path)
+        manifest[path] = entry
+    if to_hash:
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            for path, digest in zip(to_hash, pool.map(md5_file, to_hash, chunksize=8)):
+                manifest[path]["digest"] = digest
+    tmp_path = manifest_path + f".{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_path, manifest_path)
+    return manifest
+
+
+def link_or_copy(source: str, destination: str) -> None:
+    """Reflinks `source` to `destination` where possible, falling back to a normal copy"""
+    if os.path.exists(destination):
+        os.unlink(destination)
+    # A copy-on-write clone shares blocks with the render but stays independent if the render is later edited
+    try:
+        import fcntl
+        with open(source, "rb") as src, open(destination, "wb") as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        return
+    except (ImportError, OSError):
+        # Not a hard link, which would share the render's inode: editing either file would then change the other
+        shutil.copyfile(source, destination)
+
+
+def refresh_manifest(audio_dir: str = AUDIO_DIR) -> None:
+    """Pre-deployment routine that brings the manifest up to date before any renders are deposited"""
+    ManifestCachedAsset._manifest = build_manifest(audio_dir)
+
+
+class ManifestCachedAsset(CachedAsset):
+    """A cached asset that takes its cache key from the manifest rather than hashing the file at deploy time"""
+
+    _manifest = None
+
+    @classmethod
+    def get_manifest(cls) -> dict:
+        if cls._manifest is None:
+            cls._manifest = load_manifest()
+        return cls._manifest
+
+    def get_md5_contents(self):
+        entry = self.get_manifest().get(os.path.normpath(self.input_path))
+        if entry is not None and not self.is_folder:
+            stat = os.stat(self.input_path)
+            # Only trust the manifest if the file hasn't changed since it was hashed
+            if entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime_ns:
+                return entry["digest"]
+        return super().get_md5_contents()
+
+
+class LinkedLocalStorage(LocalStorage):
+    """Local storage that reflinks deposited files into the storage root instead of copying them, where possible"""
+
+    def _receive_deposit(self, asset, host_path: str):
+        if asset.is_folder or not (self.on_deployed_server() or self.is_local_deployment()):
+            return super()._receive_deposit(asset, host_path)
+        file_system_path = os.path.expanduser(self.get_file_system_path(host_path))
+        os.makedirs(os.path.dirname(file_system_path), exist_ok=True)
+        link_or_copy(asset.input_path, file_system_path)
+        asset.deposited = True
+
+    @staticmethod
+    def is_local_deployment() -> bool:
+        from psynet import deployment_info
+        return deployment_info.read("is_local_deployment")
+
+
+if __name__ == "__main__":
+    built = build_manifest()
+    print(f"Wrote digests for {len(built)} renders to {MANIFEST_PATH}")
@@ -0,0 +1,170 @@
+"""Serving deposited assets from content-hashed URLs, so that browsers can cache them for good.
+
+An asset's URL is `/immutable/<md5 of its contents>/<host path>`. As a changed file gets a new URL, responses can be
+cached indefinitely (`Cache-Control: immutable`), so reloading a page costs no requests at all. The digest doubles as
+a strong ETag for revalidation (`If-None-Match` -> 304), and byte ranges are supported so that playback can start
+before the whole file has arrived.
+
+Run `python asset_server.py <directory>` to measure the bytes sent per participant session by a stand-in server,
+with and without these headers.
+"""
+
+import os
+from functools import lru_cache
+
+from flask import Flask, abort, request, send_file
+
+try:
+    from .asset_manifest import md5_file
+except ImportError:
+    from asset_manifest import md5_file
+
+IMMUTABLE_ROUTE = "/immutable"
+MAX_AGE = 365 * 24 * 60 * 60    # a year, the longest that caches honour
+# Size of the first range request, enough for the browser to start decoding and playing
+START_BYTES = 64 * 1024
+
+
+@lru_cache(maxsize=None)
+def _cached_digest(path: str, size: int, mtime: int) -> str:
+    return md5_file(path)
+
+
+def file_digest(path: str) -> str:
+    """The MD5 of a file's contents, hashed once per process unless the file changes"""
+    stat = os.stat(path)
+    return _cached_digest(path, stat.st_size, stat.st_mtime_ns)
+
+
+def immutable_url(host_path: str, digest: str) -> str:
+    return f"{IMMUTABLE_ROUTE}/{digest}/{host_path}"
+
+
+def asset_url(asset) -> str:
+    """The content-hashed URL of a deposited asset.
+
+    The digest is the MD5 that PsyNet stored as the asset's `content_id` when it was deposited, so no file is read
+    (the input files aren't shipped to the server). Assets without one keep their storage URL.
+    """
+    if not asset.content_id:
+        return asset.url
+    return immutable_url(asset.host_path, asset.content_id)
+
+
+def is_safe_path(host_path: str) -> bool:
+    """Whether a host path stays within the storage root"""
+    return not os.path.isabs(host_path) and ".." not in host_path.split("/")
+
+
+def serve_immutable(path: str, digest: str):
+    """Sends a file with far-future caching, its digest as ETag, and support for conditional and range requests"""
+    if not os.path.isfile(path) or file_digest(path) != digest:
+        # An out-of-date URL must not cache different contents under the old digest
+        abort(404)
+    response = send_file(path, conditional=True, etag=digest, max_age=MAX_AGE)
+    response.headers["Cache-Control"] = f"public, max-age={MAX_AGE}, immutable"
+    return response
+
+
+def make_test_server(root: str) -> Flask:
+    """A stand-in static server for `root`, which counts the bytes sent to each session (the `X-Session` header).
+
+    `/immutable/...` serves as the experiment does; `/plain/<path>` serves without validators or caching headers.
+    """
+    app = Flask(__name__)
+    app.config["session_bytes"] = {}
+
+    @app.route(IMMUTABLE_ROUTE + "/<digest>/<path:host_path>")
+    def immutable(digest, host_path):
+        if not is_safe_path(host_path):
+            abort(404)
+        return serve_immutable(os.path.join(root, host_path), digest)
+
+    @app.route("/plain/<path:host_path>")
+    def plain(host_path):
+        if not is_safe_path(host_path):
+            abort(404)
+        response = send_file(os.path.join(root, host_path), conditional=False, etag=False)
+        response.headers["Cache-Control"] = "no-store"
+        return response
+
+    @app.after_request
+    def count_bytes(response):
+        session = request.headers.get("X-Session", "")
+        totals = app.config["session_bytes"]
+        totals[session] = totals.get(session, 0) + (response.content_length or 0)
+        return response
+
+    return app
+
+
+class BrowserCache:
+    """Just enough of a browser's HTTP cache to replay a participant session against a Flask test client"""
+
+    def __init__(self, client, session: str):
+        self.client, self.session = client, session
+        self.entries = {}    # url -> (ETag, fresh without revalidation)
+
+    def _request(self, url: str, headers: dict = None):
+        headers = {"X-Session": self.session, **(headers or {})}
+        cached = self.entries.get(url)
+        if cached is not None and cached[0]:
+            headers["If-None-Match"] = cached[0]
+        response = self.client.get(url, headers=headers)
+        response.get_data()
+        return response
+
+    def _store(self, url: str, response) -> None:
+        cache_control = response.headers.get("Cache-Control", "")
+        if response.status_code in (200, 206) and "no-store" not in cache_control:
+            self.entries[url] = (response.headers.get("ETag"), "immutable" in cache_control)
+
+    def get(self, url: str, headers: dict = None) -> int:
+        """Requests a URL unless a fresh copy is cached, returning the response status (0 if served from the cache)"""
+        cached = self.entries.get(url)
+        if cached is not None and cached[1]:
+            return 0
+        response = self._request(url, headers)
+        self._store(url, response)
+        return response.status_code
+
+    def play(self, url: str) -> None:
+        """Loads audio as a browser does: a first range to start playback, then the rest of the file"""
+        if url in self.entries:
+            # A cached copy is used as is if fresh, or else revalidated as a whole
+            self.get(url)
+            return
+        response = self._request(url, {"Range": f"bytes=0-{START_BYTES - 1}"})
+        if response.status_code == 206:
+            self._request(url, {"Range": f"bytes={START_BYTES}-"})
+        self._store(url, response)
+
+
+def measure(root: str, n_reloads: int = 1) -> dict:
+    """Bytes sent for one session that plays every file in `root` and reloads each page `n_reloads` times"""
+    app = make_test_server(root)
+    files = sorted(os.path.relpath(os.path.join(d, f), root) for d, _, fs in os.walk(root) for f in fs)
+    urls = {
+        "plain": [f"/plain/{f}" for f in files],
+        "immutable": [immutable_url(f, file_digest(os.path.join(root, f))) for f in files],
+    }
+    with app.test_client() as client:
+        for mode, mode_urls in urls.items():
+            browser = BrowserCache(client, mode)
+            for url in mode_urls:
+                for _ in range(1 + n_reloads):
+                    browser.play(url)
+    return {mode: app.config["session_bytes"].get(mode, 0) for mode in urls}
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Measure the bytes sent per session with and without caching headers")
+    parser.add_argument("root", nargs="?", default="assets/render")
+    parser.add_argument("--reloads", type=int, default=1, help="Times that each page is reloaded")
+    args = parser.parse_args()
+    sent = measure(args.root, args.reloads)
+    for mode_name, n_bytes in sent.items():
+        print(f"{mode_name:<10} {n_bytes / 1e6:10.2f} MB")
+    print(f"Saved {1 - sent['immutable'] / sent['plain']:.0%}")
@@ -0,0 +1,240 @@
+"""Micro-benchmarks for the experiment's hot paths. Run with e.g. `bash docker/run python benchmark.py rating`"""
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import timeit
+from collections import defaultdict
+
+
+def report(label: str, timer: timeit.Timer, number: int, repeat: int = 5) -> float:
+    """Prints and returns the best per-call time (in microseconds) for the given timer"""
+    best = min(timer.repeat(repeat=repeat, number=number)) / number * 1e6
+    print(f"{label:<40} {best:10.2f} µs/call")
+    return best
+
+
+def thaw(obj):
+    """Rebuilds a frozen design as plain dicts and lists, as the old per-page dict literal did"""
+    if isinstance(obj, dict):
+        return {k: thaw(v) for k, v in obj.items()}
+    if isinstance(obj, tuple):
+        return [thaw(v) for v in obj]
+    return obj
+
+
+def template_app():
+    """A bare Flask app that loads templates from this directory, then PsyNet's, as the experiment server does"""
+    from flask import Flask
+    from jinja2 import ChoiceLoader, FileSystemLoader, PackageLoader
+
+    app = Flask(__name__, static_folder=None)
+    app.jinja_loader = ChoiceLoader([
+        FileSystemLoader(os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")),
+        PackageLoader("psynet", "templates"),
+    ])
+    # The SurveyJS macros link their stylesheet through url_for
+    app.add_url_rule("/static/<path:filename>", "static", lambda filename: "")
+    return app
+
+
+def benchmark_rating(number: int) -> None:
+    """Compares building and rendering the rating page with the old per-page design and with the shared spec"""
+    from psynet.modular_page import ModularPage, SurveyJSControl
+    from rating import RATING_DESIGN, RatingSurveyControl
+
+    app = template_app()
+    # Like PsyNet, each call compiles the page template, so far fewer calls are needed
+    number = max(1, number // 100)
+
+    def render(control) -> str:
+        # Only the control's part of the page template differs between the two, so only that part is rendered
+        page = ModularPage("rate", "Listen to the performance", control, time_estimate=5)
+        template = page.import_templates + page.get_renderers()["control"]
+        return app.jinja_env.from_string(template).render(control_config=page.control)
+
+    with app.test_request_context():
+        # Compile and cache the imported templates before timing either version
+        render(SurveyJSControl(design=thaw(RATING_DESIGN)))
+        render(RatingSurveyControl())
+        before = report(
+            "rating page: SurveyJSControl(design=...)",
+            timeit.Timer(lambda: render(SurveyJSControl(design=thaw(RATING_DESIGN)))),
+            number
+        )
+        after = report(
+            "rating page: RatingSurveyControl",
+            timeit.Timer(lambda: render(RatingSurveyControl())),
+            number
+        )
+    print(f"Speed-up: {before / after:.1f}x")
+
+
+def benchmark_decode(number: int) -> None:
+    """Compares `ast.literal_eval` with the export decoder on every `metadata_` field in the export"""
+    import ast
+    from export import decode_python_literal, iter_records
+
+    fields = [r["metadata_"] for r in iter_records() if isinstance(r["metadata_"], str)]
+    number = max(1, number // 1000)
+    before = report(
+        "metadata_ decode: ast.literal_eval",
+        timeit.Timer(lambda: [ast.literal_eval(f) for f in fields]),
+        number
+    )
+    after = report(
+        "metadata_ decode: decode_python_literal",
+        timeit.Timer(lambda: [decode_python_literal(f) for f in fields]),
+        number
+    )
+    print(f"Speed-up: {before / after:.1f}x")
+
+
+def benchmark_static(number: int) -> None:
+    """Compares rendering the consent information sheet on every request with serving the cached HTML"""
+    from consent import information_sheet
+
+    before = report(
+        "information sheet: render tree",
+        timeit.Timer(lambda: information_sheet.__wrapped__().render()),
+        number // 10
+    )
+    after = report("information sheet: cached HTML", timeit.Timer(information_sheet), number)
+    print(f"Speed-up: {before / after:.1f}x")
+
+
+def benchmark_payload(number: int) -> None:
+    """Compares building the rating and feedback page content on every trial with reading the node's payload"""
+    from dominate import tags
+
+    from catalogue import load_catalogue
+    from experiment import PROMPT_METADATA_FIELDS, PROMPT_TEXT, feedback_text, node_payload
+
+    stimulus = next(iter(load_catalogue().values()))
+    definition = {field: stimulus[field] for field in ["genre", "num", "condition", "metadata"]}
+    definition["payload"] = node_payload(definition)
+
+    def rebuild():
+        # As `RateTrial` used to: the prompt text, the prompt metadata and the feedback text
+        metadata = definition["metadata"]
+        text = tags.div(tags.h1("Listen to the performance"))
+        prompt_metadata = {k: metadata[k] for k in PROMPT_METADATA_FIELDS}
+        return {"text": str(text), "url": "", "play_window": None} | prompt_metadata, feedback_text(metadata)
+
+    def precomputed():
+        payload = definition["payload"]
+        prompt_metadata = {"text": str(PROMPT_TEXT), "url": "", "play_window": None} | payload["prompt_metadata"]
+        return prompt_metadata, payload["feedback_text"]
+
+    before = report("rating trial content: rebuild", timeit.Timer(rebuild), number)
+    after = report("rating trial content: node payload", timeit.Timer(precomputed), number)
+    print(f"Speed-up: {before / after:.1f}x")
+
+
+def benchmark_definitions(number: int) -> None:
+    """Compares the JSON size of the node and trial definitions stored for the catalogue, as originally and now"""
+    from catalogue import load_catalogue
+    from experiment import TRIALS_PER_PARTICIPANT, node_definition
+
+    stimuli = load_catalogue()
+    # Originally each node carried the full metadata, and each trial a deep copy of its node's definition
+    before_nodes = [
+        {field: stimulus[field] for field in ["genre", "num", "condition", "metadata"]} for stimulus in stimuli.values()
+    ]
+    after_nodes = [node_definition(key, stimulus) for key, stimulus in stimuli.items()]
+    after_trials = [{k: v for k, v in definition.items() if k != "payload"} for definition in after_nodes]
+
+    def mean_size(definitions: list) -> float:
+        return sum(len(json.dumps(definition)) for definition in definitions) / len(definitions)
+
+    for label, before, after in [
+        ("node definition", mean_size(before_nodes), mean_size(after_nodes)),
+        ("trial definition", mean_size(before_nodes), mean_size(after_trials)),
+    ]:
+        print(f"{label:<40} {before:10.0f} B -> {after:6.0f} B")
+    n_trials = len(stimuli) * TRIALS_PER_PARTICIPANT
+    print(f"{'trial definitions (' + str(n_trials) + ' trials)':<40} "
+          f"{mean_size(before_nodes) * n_trials / 1e6:10.2f} MB -> {mean_size(after_trials) * n_trials / 1e6:6.2f} MB")
+
+
+# Per-package import times recorded with `--record-baseline`, which later runs are compared against. Times depend on
+# the machine, so the file is local (and ignored by git): record it before changing imports, then compare after
+IMPORT_TIME_BASELINE = "importtime_baseline.json"
+IMPORT_TIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def import_times(module: str) -> dict:
+    """Imports a module in a fresh interpreter with `-X importtime`, returning each module's self time in µs"""
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        check=True,
+        capture_output=True,
+        text=True
+    ).stderr
+    return {m.group(4): int(m.group(1)) for m in map(IMPORT_TIME_LINE.match, stderr.splitlines()) if m}
+
+
+def benchmark_importtime(
+        number: int,
+        module: str = "experiment",
+        top: int = 15,
+        baseline_path: str = IMPORT_TIME_BASELINE,
+        record: bool = False
+) -> None:
+    """Reports the cold-start import time of the experiment, broken down by top-level package"""
+    # Each run is a whole interpreter start-up, so a handful of runs is plenty
+    runs = [import_times(module) for _ in range(max(1, min(number // 1000, 10)))]
+    best = min(runs, key=lambda run: sum(run.values()))
+    by_package = defaultdict(int)
+    for name, self_time in best.items():
+        by_package[name.split(".")[0]] += self_time
+    baseline = {}
+    if os.path.exists(baseline_path) and not record:
+        with open(baseline_path, "r") as f:
+            baseline = json.load(f)
+
+    def line(label: str, self_time: int, key: str) -> str:
+        text = f"{label:<40} {self_time / 1000:10.1f} ms"
+        if baseline:
+            text += f" {(self_time - baseline.get(key, 0)) / 1000:+10.1f} ms"
+        return text
+
+    print(line(f"import {module} (best of {len(runs)})", sum(best.values()), "total"))
+    for package, self_time in sorted(by_package.items(), key=lambda item: -item[1])[:top]:
+        print(line("  " + package, self_time, package))
+    if baseline:
+        # Packages that are no longer imported at all
+        for package in sorted(set(baseline) - set(by_package) - {"total"}, key=lambda p: -baseline[p])[:top]:
+            print(line("  " + package, 0, package))
+    if record:
+        with open(baseline_path, "w") as f:
+            json.dump({"total": sum(best.values()), **dict(sorted(by_package.items()))}, f, indent=1)
+        print(f"Recorded as the baseline in {baseline_path}")
+
+
+BENCHMARKS = {
+    "rating": benchmark_rating,
+    "decode": benchmark_decode,
+    "static": benchmark_static,
+    "payload": benchmark_payload,
+    "definitions": benchmark_definitions,
+    "importtime": benchmark_importtime,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("benchmark", choices=[*BENCHMARKS, "all"])
+    parser.add_argument("--number", type=int, default=10000, help="Calls per timing repeat")
+    parser.add_argument(
+        "--record-baseline", action="store_true", help=f"Record the import times in {IMPORT_TIME_BASELINE}"
+    )
+    args = parser.parse_args()
+    for name in BENCHMARKS if args.benchmark == "all" else [args.benchmark]:
+        if name == "importtime":
+            benchmark_importtime(args.number, record=args.record_baseline)
+        else:
+            BENCHMARKS[name](args.number)
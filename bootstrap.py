@@ -0,0 +1,163 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+CHUNK_SIZE = 1000    # Resamples per chunk: memory grows with chunk size x number of participants, not the total
+
+
+def _seed_sequences(seed, n_chunks: int) -> list:
+    # Without an explicit seed, draw one from NumPy's global state so that `seed_everything` makes runs reproducible
+    if seed is None:
+        seed = np.random.randint(2 ** 31)
+    return np.random.SeedSequence(seed).spawn(n_chunks)
+
+
+def _chunk_sizes(total: int, chunk_size: int) -> list:
+    return [min(chunk_size, total - start) for start in range(0, total, chunk_size)]
+
+
+def _cluster_totals(values: np.ndarray, clusters: np.ndarray, groups: np.ndarray, n_clusters: int, n_groups: int):
+    """Sums and counts of the values for each cluster and group, as (n_clusters, n_groups) arrays"""
+    cells = clusters * n_groups + groups
+    sums = np.bincount(cells, weights=values, minlength=n_clusters * n_groups).reshape(n_clusters, n_groups)
+    counts = np.bincount(cells, minlength=n_clusters * n_groups).reshape(n_clusters, n_groups)
+    return sums, counts
+
+
+def _bootstrap_chunk(sums: np.ndarray, counts: np.ndarray, n_resamples: int, seed_sequence) -> np.ndarray:
+    """Group means for one chunk of cluster resamples"""
+    rng = np.random.default_rng(seed_sequence)
+    n_clusters = len(sums)
+    # Every resample is a row of cluster indices, turned into how many times each cluster was drawn
+    draws = rng.integers(0, n_clusters, size=(n_resamples, n_clusters))
+    draws += np.arange(n_resamples)[:, None] * n_clusters
+    weights = np.bincount(draws.ravel(), minlength=n_resamples * n_clusters).reshape(n_resamples, n_clusters)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (weights @ sums) / (weights @ counts)
+
+
+def bootstrap_group_means(
+        values: np.ndarray,
+        clusters: np.ndarray,
+        groups: np.ndarray,
+        n_resamples: int = 10000,
+        seed: int = None,
+        chunk_size: int = CHUNK_SIZE,
+        n_workers: int = None
+) -> np.ndarray:
+    """Cluster bootstrap of the mean value of each group, resampling whole clusters (e.g. participants).
+
+    `clusters` and `groups` are integer codes from 0. Returns an (n_resamples, n_groups) array of group means.
+    """
+    n_clusters, n_groups = clusters.max() + 1, groups.max() + 1
+    sums, counts = _cluster_totals(values, clusters, groups, n_clusters, n_groups)
+    sizes = _chunk_sizes(n_resamples, chunk_size)
+    seed_sequences = _seed_sequences(seed, len(sizes))
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        chunks = pool.map(_bootstrap_chunk, [sums] * len(sizes), [counts] * len(sizes), sizes, seed_sequences)
+        return np.concatenate(list(chunks))
+
+
+def _permutation_chunk(
+        values: np.ndarray,
+        clusters: np.ndarray,
+        groups: np.ndarray,
+        a: int,
+        b: int,
+        n_permutations: int,
+        seed_sequence
+) -> np.ndarray:
+    """Differences in mean (a - b) after shuffling the group labels within each cluster, for one chunk"""
+    rng = np.random.default_rng(seed_sequence)
+    # Sorting random keys offset by cluster shuffles each row of labels within clusters (clusters must be sorted)
+    keys = rng.random((n_permutations, len(groups))) + clusters[None, :]
+    permuted = groups[np.argsort(keys, axis=1)]
+    in_a, in_b = permuted == a, permuted == b
+    return (in_a @ values) / in_a.sum(axis=1) - (in_b @ values) / in_b.sum(axis=1)
+
+
+def permutation_test(
+        values: np.ndarray,
+        clusters: np.ndarray,
+        groups: np.ndarray,
+        a: int,
+        b: int,
+        n_permutations: int = 10000,
+        seed: int = None,
+        chunk_size: int = CHUNK_SIZE,
+        n_workers: int = None
+) -> float:
+    """Two-sided p-value for a difference in mean between groups `a` and `b`, permuting labels within clusters"""
+    order = np.argsort(clusters, kind="stable")
+    values, clusters, groups = values[order], clusters[order], groups[order]
+    observed = values[groups == a].mean() - values[groups == b].mean()
+    sizes = _chunk_sizes(n_permutations, chunk_size)
+    seed_sequences = _seed_sequences(seed, len(sizes))
+    n = len(sizes)
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        null = np.concatenate(list(pool.map(
+            _permutation_chunk, [values] * n, [clusters] * n, [groups] * n, [a] * n, [b] * n, sizes, seed_sequences
+        )))
+    return float((np.sum(np.abs(null) >= abs(observed)) + 1) / (n_permutations + 1))
+
+
+def compare_conditions(
+        ratings: pd.DataFrame,
+        measure: str,
+        by: str = "condition_type",
+        reference: str = None,
+        n_resamples: int = 10000,
+        seed: int = None,
+        alpha: float = 0.05,
+        permutation: bool = True,
+        n_workers: int = None
+) -> pd.DataFrame:
+    """Compares the mean of `measure` between each level of `by` and a reference level, in a rating table.
+
+    Gives the difference, its percentile bootstrap confidence interval (resampling participants), and
+    optionally a within-participant permutation p-value.
+    """
+    ratings = ratings.dropna(subset=[measure, by])
+    values = ratings[measure].to_numpy(dtype=float)
+    clusters = pd.factorize(ratings["participant_id"])[0]
+    groups, levels = pd.factorize(ratings[by], sort=True)
+    reference = levels[0] if reference is None else reference
+    ref = list(levels).index(reference)
+    means = bootstrap_group_means(values, clusters, groups, n_resamples, seed, n_workers=n_workers)
+    rows = []
+    for i, level in enumerate(levels):
+        if i == ref:
+            continue
+        differences = means[:, i] - means[:, ref]
+        low, high = np.nanpercentile(differences, [100 * alpha / 2, 100 * (1 - alpha / 2)])
+        row = {
+            by: level,
+            "reference": reference,
+            "difference": values[groups == i].mean() - values[groups == ref].mean(),
+            "ci_low": low,
+            "ci_high": high,
+        }
+        if permutation:
+            row["p_value"] = permutation_test(values, clusters, groups, i, ref, n_resamples, seed, n_workers=n_workers)
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from export import EXPORT_PATH
+    from tables import RATING_SCALES, build_tables
+
+    parser = argparse.ArgumentParser(description="Compare ratings between conditions with a participant bootstrap")
+    parser.add_argument("measure", choices=[*RATING_SCALES, "genre_correct"])
+    parser.add_argument("--by", default="condition_type")
+    parser.add_argument("--reference")
+    parser.add_argument("--n-resamples", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--path", default=EXPORT_PATH)
+    args = parser.parse_args()
+    rating_table = build_tables(args.path)["rating"]
+    comparison = compare_conditions(rating_table, args.measure, args.by, args.reference, args.n_resamples, args.seed)
+    print(comparison.to_string(index=False))
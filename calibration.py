@@ -1,18 +1,29 @@
 from dominate import tags
+from markupsafe import Markup
 
-from psynet.page import VolumeCalibration, PageMaker
-from psynet.modular_page import ModularPage, ImagePrompt, AudioPrompt, OptionControl, PushButton, Control, RadioButtonControl
-from psynet.timeline import Event, Module, MediaSpec, FailedValidation
+from psynet.page import VolumeCalibration
+from psynet.modular_page import AudioPrompt, Prompt
+from psynet.timeline import MediaSpec, switch
+
+try:
+    from .profiling import timed
+    from .renditions import RENDITIONS, choose_rendition, get_download_speed, rendition_path
+except ImportError:
+    from profiling import timed
+    from renditions import RENDITIONS, choose_rendition, get_download_speed, rendition_path
+
+TRIAD_CLIPS = ["anchor", "test_a", "test_b"]
 
 
 class AudioCalibration(VolumeCalibration):
     def __init__(
-            self, audio: str, min_time: float = 2.5, time_estimate: float = 5
+            self, audio: str, min_time: float = 2.5, time_estimate: float = 5, id_: str = "volume_calibration"
     ):
         super().__init__(
             url=audio,
             min_time=min_time,
-            time_estimate=time_estimate
+            time_estimate=time_estimate,
+            id_=id_
         )
 
     def text(self):
@@ -34,7 +45,28 @@ class AudioCalibration(VolumeCalibration):
         )
 
 
+def audio_calibration(audio: str, time_estimate: float = 5):
+    """Volume calibration that plays the rendition of `audio` suited to the participant's connection.
+
+    Each rendition is a calibration module of its own, so that its file is deposited as an asset. The renditions are
+    built before deployment by the `build_renditions` pre-deploy routine.
+    """
+    branches = {"original": AudioCalibration(audio=audio, time_estimate=time_estimate)}
+    for name in RENDITIONS:
+        branches[name] = AudioCalibration(
+            audio=rendition_path(audio, name), time_estimate=time_estimate, id_=f"volume_calibration_{name}"
+        )
+    return switch(
+        "audio_calibration",
+        lambda participant: choose_rendition(get_download_speed(participant)) or "original",
+        branches,
+        fix_time_credit=True
+    )
+
+
 class AudioPromptMultiple(AudioPrompt):
+    """Anchor/test_a/test_b comparison prompt"""
+
     macro = "audio_multi"
     external_template = "custom-prompt.html"
 
@@ -45,13 +77,7 @@ class AudioPromptMultiple(AudioPrompt):
 
     @property
     def media(self):
-        return MediaSpec(
-            audio={
-                "anchor": self.all_audios["anchor"],
-                "test_a": self.all_audios["test_a"],
-                "test_b": self.all_audios["test_b"],
-            }
-        )
+        return MediaSpec(audio={clip: self.all_audios[clip] for clip in TRIAD_CLIPS})
 
     @property
     def metadata(self):
@@ -62,12 +88,36 @@ class AudioPromptMultiple(AudioPrompt):
         } | self.definition
 
 
+def prefetch_html(urls: list[str]) -> Markup:
+    """Link tags that make the browser download the given audio into its cache while the page is shown"""
+    return Markup("").join(Markup('<link rel="prefetch" as="audio" href="{}">').format(url) for url in urls)
+
+
+class PrefetchPrompt(Prompt):
+    """A text prompt that also prefetches the given URLs, without adding them to the text stored in the metadata"""
+
+    def __init__(self, *args, **kwargs):
+        self.prefetch = kwargs.pop("prefetch", [])
+        super().__init__(*args, **kwargs)
+
+    @property
+    def text_html(self):
+        return Markup(super().text_html) + prefetch_html(self.prefetch)
+
+
 class AudioPromptCustom(AudioPrompt):
     def __init__(self,  *args, **kwargs):
-        self.definition = kwargs.pop("definition")
+        self.payload = kwargs.pop("payload")
+        self.prefetch = kwargs.pop("prefetch", [])
         super().__init__(*args, **kwargs)
 
     @property
+    def text_html(self):
+        return Markup(super().text_html) + prefetch_html(self.prefetch)
+
+    @property
+    @timed("prompt_metadata")
     def metadata(self):
-        meta = {k: self.definition["metadata"][k] for k in ["condition_token", "similarity", "condition_type", "track_fpath"]}
-        return {"text": str(self.text), "url": self.url, "play_window": self.play_window} | meta
+        # The stimulus metadata are precomputed per node (see `experiment.node_payload`)
+        prompt_metadata = self.payload["prompt_metadata"]
+        return {"text": str(self.text), "url": self.url, "play_window": self.play_window} | prompt_metadata
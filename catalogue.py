@@ -0,0 +1,112 @@
+import hashlib
+import json
+import os
+
+AUDIO_DIR = 'assets/render'
+METADATA_DIR = "assets/metadata"
+CATALOGUE_PATH = "assets/catalogue.json"
+
+# Bump this whenever the structure of a catalogue entry changes, so that old catalogues are rebuilt
+CATALOGUE_VERSION = 1
+
+
+def stimulus_key(genre: str, num: str, condition: str) -> str:
+    """Returns the key used to index a stimulus in the catalogue, e.g. `avantgardejazz_001_clamp`"""
+    return "_".join([genre, num, condition])
+
+
+def parse_stimulus_key(key: str) -> tuple[str, int, str]:
+    """Splits a stimulus key back into its genre, number and condition, e.g. `("avantgardejazz", 1, "clamp")`"""
+    genre, num, condition = key.split("_")
+    return genre, int(num), condition
+
+
+def get_fingerprint(audio_dir: str = AUDIO_DIR, metadata_dir: str = METADATA_DIR) -> str:
+    """Hashes the names, sizes and modification times of all renders and metadata files, without opening them"""
+    hasher = hashlib.md5()
+    for directory, extension in [(audio_dir, ".mp3"), (metadata_dir, ".json")]:
+        with os.scandir(directory) as entries:
+            for entry in sorted(entries, key=lambda e: e.name):
+                if not entry.name.endswith(extension):
+                    continue
+                stat = entry.stat()
+                hasher.update(f"{entry.name}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+    return hasher.hexdigest()
+
+
+def scan_stimuli(audio_dir: str = AUDIO_DIR, metadata_dir: str = METADATA_DIR) -> dict:
+    """Builds the catalogue entries by listing all renders and reading the metadata for each one"""
+    stimuli = {}
+    render_paths = sorted([i for i in os.listdir(audio_dir) if i.endswith(".mp3")])
+    for render in render_paths:
+        genre, num, condition = render.split("_")
+        condition = condition.split(".")[0]    # remove the extension
+        key = stimulus_key(genre, num, condition)
+        # Grab the metadata using the filepath
+        with open(os.path.join(metadata_dir, key + ".json"), "r") as f:
+            metadata_read = json.load(f)
+        metadata_read["track_fpath"] = render
+        stimuli[key] = {
+            "genre": genre,
+            "num": int(num),
+            "condition": condition,
+            "render": render,
+            "metadata": metadata_read
+        }
+    return stimuli
+
+
+def write_catalogue(stimuli: dict, fingerprint: str, catalogue_path: str = CATALOGUE_PATH) -> None:
+    """Writes catalogue entries to a single file, tagged with the fingerprint of the files they were built from"""
+    catalogue = {"version": CATALOGUE_VERSION, "fingerprint": fingerprint, "stimuli": stimuli}
+    # Write to a temporary file first so that concurrent readers never see a partially written catalogue
+    tmp_path = catalogue_path + f".{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(catalogue, f)
+    os.replace(tmp_path, catalogue_path)
+
+
+def build_catalogue(
+        audio_dir: str = AUDIO_DIR,
+        metadata_dir: str = METADATA_DIR,
+        catalogue_path: str = CATALOGUE_PATH
+) -> dict:
+    """Scans all stimuli and writes them to the catalogue file, returning the catalogue entries"""
+    fingerprint = get_fingerprint(audio_dir, metadata_dir)
+    stimuli = scan_stimuli(audio_dir, metadata_dir)
+    write_catalogue(stimuli, fingerprint, catalogue_path)
+    return stimuli
+
+
+def load_catalogue(
+        audio_dir: str = AUDIO_DIR,
+        metadata_dir: str = METADATA_DIR,
+        catalogue_path: str = CATALOGUE_PATH
+) -> dict:
+    """Loads the catalogue entries in a single read, falling back to a scan if the catalogue is missing or stale"""
+    fingerprint = get_fingerprint(audio_dir, metadata_dir)
+    try:
+        with open(catalogue_path, "r") as f:
+            catalogue = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        catalogue = {}
+    if catalogue.get("version") == CATALOGUE_VERSION and catalogue.get("fingerprint") == fingerprint:
+        return catalogue["stimuli"]
+    stimuli = scan_stimuli(audio_dir, metadata_dir)
+    try:
+        write_catalogue(stimuli, fingerprint, catalogue_path)
+    # We might not be able to write the catalogue (e.g. read-only deployments), but the scan is still valid
+    except OSError:
+        pass
+    return stimuli
+
+
+def read_catalogue(catalogue_path: str = CATALOGUE_PATH) -> dict:
+    """Reads the catalogue entries as written, without checking them against the stimulus files (e.g. for analysis)"""
+    with open(catalogue_path, "r") as f:
+        return json.load(f)["stimuli"]
+
+
+if __name__ == "__main__":
+    built = build_catalogue()
+    print(f"Wrote {len(built)} stimuli to {CATALOGUE_PATH}")
@@ -1,12 +1,41 @@
-import os
-import random
-
 from dominate import tags
 
-from psynet.modular_page import ModularPage, AudioPrompt, ImagePrompt, PushButtonControl, Prompt
-from psynet.prescreen import HeadphoneTest
-from psynet.page import InfoPage, SuccessfulEndPage, UnsuccessfulEndPage
-from psynet.timeline import CodeBlock, PageMaker, join, Event, Module, conditional
+from psynet.page import InfoPage
+
+try:
+    from .static_html import static_html
+except ImportError:
+    from static_html import static_html
+
+
+@static_html
+def requirements_html():
+    return tags.div(
+        tags.h1('Experiment requirements'),
+        tags.p(
+            tags.strong('Location:'),
+            tags.span(
+                """
+                This experiment requires you to be sitting in a quiet environment where you can clearly see your 
+                computer screen.
+                """
+            )
+        ),
+        tags.p(
+            tags.strong('Headphones:'),
+            tags.span(
+                """
+                This experiment also requires you to wear headphones. 
+                Please ensure you have plugged yours in now.
+                """
+            )
+        ),
+        tags.p(
+            """
+            The next page will play some test audio. Please turn down your volume before proceeding.
+            """
+        )
+    )
 
 
 def experiment_requirements(
@@ -18,32 +47,4 @@ def experiment_requirements(
     :return:
     """
 
-    return InfoPage(
-        tags.div(
-            tags.h1('Experiment requirements'),
-            tags.p(
-                tags.strong('Location:'),
-                tags.span(
-                    """
-                    This experiment requires you to be sitting in a quiet environment where you can clearly see your 
-                    computer screen.
-                    """
-                )
-            ),
-            tags.p(
-                tags.strong('Headphones:'),
-                tags.span(
-                    """
-                    This experiment also requires you to wear headphones. 
-                    Please ensure you have plugged yours in now.
-                    """
-                )
-            ),
-            tags.p(
-                """
-                The next page will play some test audio. Please turn down your volume before proceeding.
-                """
-            )
-        ),
-        time_estimate=time_estimate,
-    )
+    return InfoPage(requirements_html(), time_estimate=time_estimate)
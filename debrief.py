@@ -1,16 +1,18 @@
 from dominate import tags
 
-from psynet.consent import NoConsent
-from psynet.modular_page import ModularPage, CheckboxControl
 from psynet.page import InfoPage
 from psynet.timeline import Module, join
 
+try:
+    from .static_html import static_html
+except ImportError:
+    from static_html import static_html
 
-def debriefing(
-        time_estimate: float = 20
-) -> Module:
-    debriefing_html = tags.div()
-    with debriefing_html:
+
+@static_html
+def debriefing_html():
+    html = tags.div()
+    with html:
         tags.h1("Debriefing")
         tags.p(
             """
@@ -37,9 +39,15 @@ def debriefing(
             )
             tags.a('hwc31@cam.ac.uk.', href='mailto:hwc31@cam.ac.uk')
 
+    return html
+
+
+def debriefing(
+        time_estimate: float = 20
+) -> Module:
     return Module(
         "debriefing",
         join(
-            InfoPage(debriefing_html, time_estimate=time_estimate),
+            InfoPage(debriefing_html(), time_estimate=time_estimate),
         )
     )
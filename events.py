@@ -0,0 +1,107 @@
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+
+try:
+    from .export import EXPORT_PATH, decode_record, iter_records
+except ImportError:
+    from export import EXPORT_PATH, decode_record, iter_records
+
+# Client events logged by PsyNet, in the order they usually happen on a page. Unknown events are coded as -1
+EVENT_TYPES = [
+    "trialConstruct",
+    "trialPrepare",
+    "trialStart",
+    "promptStart",
+    "responseEnable",
+    "submitEnable",
+    "audioFinished: prompt",
+    "promptEnd",
+    "trialFinish",
+    "trialFinished",
+]
+EVENT_CODES = {event_type: code for code, event_type in enumerate(EVENT_TYPES)}
+
+
+def event_table(records: Iterable[dict]) -> dict:
+    """Flattens the event logs of decoded responses into flat arrays.
+
+    Returns a dictionary of per-trial arrays (`response_id`, `participant_id`, `time_taken`), per-event arrays
+    (`timestamp` in milliseconds since the epoch, `event` codes indexing `EVENT_TYPES`), and `offsets`, such that
+    the events of trial `i` are `offsets[i]:offsets[i + 1]`.
+    """
+    response_ids, participant_ids, times_taken, lengths = [], [], [], []
+    timestamps, events = [], []
+    for record in records:
+        metadata = record["metadata_"]
+        log = metadata.get("event_log") or []
+        response_ids.append(int(record["id"]))
+        participant_ids.append(int(record["participant_id"]))
+        times_taken.append(metadata.get("time_taken", np.nan))
+        lengths.append(len(log))
+        for event in log:
+            # Times are logged in UTC, which numpy assumes anyway
+            timestamps.append(event["localTime"].rstrip("Z"))
+            events.append(EVENT_CODES.get(event["eventType"], -1))
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return {
+        "response_id": np.array(response_ids, dtype=np.int32),
+        "participant_id": np.array(participant_ids, dtype=np.int32),
+        "time_taken": np.array(times_taken, dtype=np.float64),
+        "offsets": offsets,
+        "timestamp": np.array(timestamps, dtype="datetime64[ms]").astype(np.int64),
+        "event": np.array(events, dtype=np.int8),
+    }
+
+
+def trial_index(table: dict) -> np.ndarray:
+    """Returns the trial that each event belongs to"""
+    return np.repeat(np.arange(len(table["offsets"]) - 1), np.diff(table["offsets"]))
+
+
+def event_time(table: dict, event_type: str, last: bool = False) -> np.ndarray:
+    """Returns the time (in ms) of the first (or last) event of the given type in each trial, or NaN if absent"""
+    trials = trial_index(table)
+    positions = np.flatnonzero(table["event"] == EVENT_CODES[event_type])
+    if last:
+        positions = positions[::-1]
+    # np.unique returns the index of the first occurrence of each trial, i.e. the first (or last) event
+    found, first = np.unique(trials[positions], return_index=True)
+    times = np.full(len(table["offsets"]) - 1, np.nan)
+    times[found] = table["timestamp"][positions[first]]
+    return times
+
+
+def event_count(table: dict, event_type: str) -> np.ndarray:
+    """Returns how many events of the given type occurred in each trial"""
+    trials = trial_index(table)
+    return np.bincount(trials[table["event"] == EVENT_CODES[event_type]], minlength=len(table["offsets"]) - 1)
+
+
+def trial_metrics(table: dict) -> pd.DataFrame:
+    """Computes per-trial timing metrics (in seconds) from an event table.
+
+    - `construct_to_start`: from `trialConstruct` (when the page is built) to the first `promptStart`
+    - `prepare_to_start`: from the first `trialPrepare` to the first `promptStart`
+    - `audio_heard`: from the first `promptStart` to the last `promptEnd`
+    - `response_time`: from the last `promptEnd` until the response was submitted
+    """
+    construct = event_time(table, "trialConstruct")
+    prompt_start = event_time(table, "promptStart")
+    prompt_end = event_time(table, "promptEnd", last=True)
+    return pd.DataFrame({
+        "response_id": table["response_id"],
+        "participant_id": table["participant_id"],
+        "construct_to_start": (prompt_start - construct) / 1000,
+        "prepare_to_start": (prompt_start - event_time(table, "trialPrepare")) / 1000,
+        "audio_heard": (prompt_end - prompt_start) / 1000,
+        "n_plays": event_count(table, "promptStart"),
+        "response_time": table["time_taken"] - (prompt_end - construct) / 1000,
+    })
+
+
+def load_trial_metrics(path: str = EXPORT_PATH, question: str = "rating") -> pd.DataFrame:
+    """Streams the responses to one question from an export and computes their timing metrics"""
+    return trial_metrics(event_table(decode_record(r) for r in iter_records(path, question=question)))
@@ -1,37 +1,54 @@
 import os
 import random
 import sys
-import json
+from typing import Optional
 
 sys.path.append("..")
 
 import numpy as np
 from dominate import tags
+from flask import abort, jsonify, request
+from markupsafe import Markup
 
 import psynet.experiment
-from psynet.asset import CachedAsset, LocalStorage
-from psynet.modular_page import SurveyJSControl, Prompt
+from psynet.experiment import authenticate, experiment_route
 from psynet.page import SuccessfulEndPage, ModularPage
 
-from psynet.timeline import Timeline, Event
+from psynet.timeline import Timeline, PreDeployRoutine
 from psynet.trial.static import StaticTrial, StaticNode, StaticTrialMaker
-from psynet.utils import get_logger
+from psynet.utils import get_config, get_logger
 
 try:
     from .consent import consent
     from .debrief import debriefing
     from .instructions import instructions
     from .questionnaire import questionnaire
-    from .calibration import AudioCalibration, AudioPromptCustom
+    from .calibration import AudioPromptCustom, PrefetchPrompt, audio_calibration
     from .checks import experiment_requirements
+    from .catalogue import AUDIO_DIR, METADATA_DIR, load_catalogue, parse_stimulus_key
+    from .asset_manifest import LinkedLocalStorage, ManifestCachedAsset, refresh_manifest
+    from .rating import RatingSurveyControl
+    from .profiling import instrument, summary, timed
+    from .schedule import claim_block, load_schedule, release_block, write_schedule
+    from .aggregate import remove_node_stats, summary_tables, update_node_stats
+    from .asset_server import IMMUTABLE_ROUTE, asset_url, is_safe_path, serve_immutable
+    from .renditions import RENDITIONS, build_renditions, choose_rendition, get_download_speed, rendition_path
 # Seems necessary when debugging on pycharm
 except ImportError:
     from consent import consent
     from debrief import debriefing
     from instructions import instructions
     from questionnaire import questionnaire
-    from calibration import AudioCalibration, AudioPromptCustom
+    from calibration import AudioPromptCustom, PrefetchPrompt, audio_calibration
     from checks import experiment_requirements
+    from catalogue import AUDIO_DIR, METADATA_DIR, load_catalogue, parse_stimulus_key
+    from asset_manifest import LinkedLocalStorage, ManifestCachedAsset, refresh_manifest
+    from rating import RatingSurveyControl
+    from profiling import instrument, summary, timed
+    from schedule import claim_block, load_schedule, release_block, write_schedule
+    from aggregate import remove_node_stats, summary_tables, update_node_stats
+    from asset_server import IMMUTABLE_ROUTE, asset_url, is_safe_path, serve_immutable
+    from renditions import RENDITIONS, build_renditions, choose_rendition, get_download_speed, rendition_path
 
 
 def seed_everything(seed: int = 42) -> None:
@@ -45,30 +62,96 @@ logger = get_logger()
 seed_everything(seed=42)
 DEBUG__ = False
 TRIALS_PER_PARTICIPANT = 3 if DEBUG__ else 15
+# Give each participant a precomputed block of stimuli instead of balancing nodes on every trial
+# (set SCHEDULED_ALLOCATION=1 in the environment, see docs/RUN.md)
+SCHEDULED_ALLOCATION = os.environ.get("SCHEDULED_ALLOCATION", "0") == "1"
+# Serve renders from content-hashed URLs that browsers cache for good, instead of the storage's own URLs
+IMMUTABLE_ASSET_URLS = True
 
 VOLUME_CALIBRATION_AUDIO = 'assets/calibration/output.mp3'
-AUDIO_DIR = 'assets/render'
-METADATA_DIR = "assets/metadata"
+
+
+def check_render_loudness(reference: str) -> None:
+    """Pre-deployment routine; `loudness` is only needed when deploying, so it isn't imported with the experiment"""
+    try:
+        from .loudness import check_loudness
+    except ImportError:
+        from loudness import check_loudness
+    check_loudness(reference=reference)
+
+
+def write_deployment_schedule(block_size: int, n_cycles: int, experiment) -> None:
+    """Pre-deployment routine that writes the schedule tagged with this deployment's ID"""
+    write_schedule(block_size, n_cycles, deployment_id=experiment.deployment_id)
+
 
 GENRES = ["avantgardejazz", "straightaheadjazz", "traditionalearlyjazz"]
 
 
-def get_nodes(audio_dir: str = AUDIO_DIR) -> list[StaticNode]:
+def get_render_assets(render_path: str) -> dict:
+    """The original render plus whichever of its renditions have been built"""
+    assets = {"render": ManifestCachedAsset(input_path=render_path)}
+    for name in RENDITIONS:
+        path = rendition_path(render_path, name)
+        if os.path.exists(path):
+            assets[f"render_{name}"] = ManifestCachedAsset(input_path=path)
+    return assets
+
+
+# Stimulus metadata stored with each rating response
+PROMPT_METADATA_FIELDS = ["condition_token", "similarity", "condition_type", "track_fpath"]
+
+
+def feedback_text(metadata: dict) -> str:
+    if metadata["condition_type"] == "real":
+        return (f"You just listened to '{metadata['track_name']}' performed by {metadata['pianist']}, an example of {metadata['condition_token']}.")
+    else:
+        return f"You just listened to a generated example of {metadata['condition_token']}."
+
+
+# The rating page's prompt, which is the same for every stimulus and so is rendered once
+PROMPT_TEXT = Markup(str(tags.div(tags.h1("Listen to the performance"))))
+
+
+def prompt_text(definition: dict) -> Markup:
+    """The rating page's prompt for a node, which only differs between nodes in debug mode"""
+    if not DEBUG__:
+        return PROMPT_TEXT
+    genre, _, condition = parse_stimulus_key(definition["stimulus"])
+    return Markup(str(tags.div(
+        tags.h1("Listen to the performance"),
+        tags.p(
+            f"Genre: {genre}\n"
+            f"Test description: {condition}\n"
+            f"Metadata {definition['payload']['prompt_metadata']}"
+        )
+    )))
+
+
+def node_payload(stimulus: dict) -> dict:
+    """What the rating and feedback pages show for a catalogue entry, computed once when its node is created"""
+    return {
+        "feedback_text": feedback_text(stimulus["metadata"]),
+        "prompt_metadata": {k: stimulus["metadata"][k] for k in PROMPT_METADATA_FIELDS},
+    }
+
+
+def node_definition(key: str, stimulus: dict) -> dict:
+    """Only what the trials need is stored with a node: the full metadata stays in the catalogue, which is joined
+    with the responses at analysis time (see `tables.stimulus_table`), and the genre, number and condition are
+    parsed from the key (see `catalogue.parse_stimulus_key`)"""
+    return {"stimulus": key, "payload": node_payload(stimulus)}
+
+
+def get_nodes(audio_dir: str = AUDIO_DIR, metadata_dir: str = METADATA_DIR) -> list[StaticNode]:
     """Gets all PsyNet nodes for the experiment"""
     nodes = []
-    render_paths = sorted([i for i in os.listdir(audio_dir) if i.endswith(".mp3")])
-    for render in render_paths:
-        genre, num, condition = render.split("_")
-        condition = condition.split(".")[0]    # remove the extension
-        # Grab the metadata using the filepath
-        metadata_path = os.path.join(METADATA_DIR, "_".join([genre, num, condition]) + ".json")
-        with open(metadata_path, "r") as f:
-            metadata_read = json.load(f)
-        metadata_read["track_fpath"] = render
-        # Construct the node
+    # The catalogue is ordered by render filename, as the directory scan used to be
+    stimuli = load_catalogue(audio_dir, metadata_dir)
+    for key, stimulus in stimuli.items():
         node = StaticNode(
-            definition={"genre": genre, "num": int(num), "condition": condition, "metadata": metadata_read},
-            assets={"render": CachedAsset(input_path=os.path.join(AUDIO_DIR, render))}
+            definition=node_definition(key, stimulus),
+            assets=get_render_assets(os.path.join(audio_dir, stimulus["render"]))
         )
         nodes.append(node)
     return nodes
@@ -77,192 +160,65 @@ def get_nodes(audio_dir: str = AUDIO_DIR) -> list[StaticNode]:
 class RateTrial(StaticTrial):
     time_estimate = 30
 
+    @property
+    def payload(self) -> dict:
+        return self.node.definition["payload"]
+
+    def make_definition(self, experiment, participant):
+        # The payload is read from the node, so trials only store which stimulus they show
+        definition = super().make_definition(experiment, participant)
+        del definition["payload"]
+        return definition
+
+    def fail(self, reason=None):
+        # A failed trial (e.g. after a premature exit) is left out of the analysis, so it leaves the running stats too
+        if self.complete and not self.failed:
+            node = StaticNode.query.with_for_update().populate_existing().get(self.node_id)
+            remove_node_stats(node, self.answer)
+        super().fail(reason=reason)
+
     def get_feedback_text(self):
-        metadata = self.node.definition["metadata"]
-        if metadata["condition_type"] == "real":
-            return (f"You just listened to '{metadata['track_name']}' performed by {metadata['pianist']}, an example of {metadata['condition_token']}.")
-        else:
-            return f"You just listened to a generated example of {metadata['condition_token']}."
+        return self.payload["feedback_text"]
+
+    def get_rendition_name(self, participant) -> str:
+        """The render asset to send, depending on the bandwidth that the participant's browser last measured"""
+        name = choose_rendition(get_download_speed(participant))
+        return "render" if name is None else f"render_{name}"
 
+    def get_prefetch(self, experiment, participant) -> list[str]:
+        next_render = self.trial_maker.get_next_render_url(
+            participant, experiment, self, self.get_rendition_name(participant)
+        )
+        return [] if next_render is None else [next_render]
+
+    @timed("show_feedback")
     def show_feedback(self, experiment, participant):
         return ModularPage(
             label="listening_feedback",
-            prompt=Prompt(
-                text=self.get_feedback_text()
+            prompt=PrefetchPrompt(
+                text=self.get_feedback_text(),
+                prefetch=self.get_prefetch(experiment, participant)
             )
         )
 
     def get_text(self):
-        text = [
-            tags.h1("Listen to the performance"),
-        ]
-        if DEBUG__:
-            text.append(tags.p(
-                    f"Genre: {self.node.definition['genre']}\n"
-                    f"Test description: {self.node.definition['condition']}\n"
-                    f"Metadata {self.node.definition['metadata']}"
-                )
-            )
-        return tags.div(*text)
+        return prompt_text(self.node.definition)
 
-    def show_trial(self, *_, **__):
+    @timed("show_trial")
+    def show_trial(self, experiment, participant):
+        audio = self.trial_maker.get_render_url(self.node.definition["stimulus"], self.get_rendition_name(participant))
         return ModularPage(
             label="rating",
             prompt=AudioPromptCustom(
-                definition=self.node.definition,
-                audio=self.node.assets['render'],
+                payload=self.payload,
+                audio=audio,
                 text=self.get_text(),
                 loop=False,
                 controls=True,
+                # Download the next render while the participant listens to this one
+                prefetch=self.get_prefetch(experiment, participant),
             ),
-            control=SurveyJSControl(design={
-                  "pages": [
-                    {
-                      "name": "page1",
-                      "elements": [
-                          {
-                              "type": "matrix",
-                              "name": "genre",
-                              "title": "Which genre best matches this performance?",
-                              "description": "Choose only one genre.",
-                              "isRequired": True,
-                              "columns": [
-                                  {
-                                      "value": "avantgardejazz",
-                                      "text": "Avant-Garde"
-                                  },
-                                  {
-                                      "value": "straightaheadjazz",
-                                      "text": "Straight-Ahead"
-                                  },
-                                  {
-                                      "value": "traditionalearlyjazz",
-                                      "text": "Traditional & Early"
-                                  }
-                              ],
-                              "rows": [
-                                  {
-                                      "value": "",
-                                      "text": ""
-                                  }
-                              ]
-                          },
-                          {
-                              "type": "rating",
-                              "name": "fit",
-                              "title": "How much does this performance sound like that genre?",
-                              "description": "Where a score of 5 means \"sounds exactly like\""
-                          },
-                        {
-                          "type": "matrix",
-                          "name": "preference",
-                          "title": "I like this performance.",
-                          "description": "Rate how strongly you agree or disagree with the statement for the performance.",
-                          "isRequired": True,
-                          "columns": [
-                            {
-                              "value": "1",
-                              "text": "Strongly dislike"
-                            },
-                            {
-                              "value": "2",
-                              "text": "Dislike"
-                            },
-                            {
-                              "value": "3",
-                              "text": "Neither like nor dislike"
-                            },
-                            {
-                              "value": "4",
-                              "text": "Like"
-                            },
-                            {
-                              "value": "5",
-                              "text": "Strongly like"
-                            }
-                          ],
-                          "rows": [
-                            {
-                              "value": "",
-                              "text": ""
-                            }
-                          ]
-                        },
-                        {
-                          "type": "matrix",
-                          "name": "diversity",
-                          "title": "The performance is creative.",
-                          "description": "Rate how strongly you agree or disagree with the statement for the performance.",
-                          "isRequired": True,
-                          "columns": [
-                            {
-                              "value": "1",
-                              "text": "Strongly disagree"
-                            },
-                            {
-                              "value": "2",
-                              "text": "Disagree"
-                            },
-                            {
-                              "value": "3",
-                              "text": "Neither agree nor disagree"
-                            },
-                            {
-                              "value": "4",
-                              "text": "Agree"
-                            },
-                            {
-                              "value": "5",
-                              "text": "Strongly agree"
-                            }
-                          ],
-                          "rows": [
-                            {
-                              "value": "",
-                              "text": ""
-                            }
-                          ]
-                        },
-                        {
-                          "type": "matrix",
-                          "name": "is_ml",
-                          "title": "The performance is generated with AI.",
-                          "description": "Rate how strongly you agree or disagree with the statement for the performance.",
-                          "isRequired": True,
-                          "columns": [
-                            {
-                              "value": "1",
-                              "text": "Strongly disagree"
-                            },
-                            {
-                              "value": "2",
-                              "text": "Disagree"
-                            },
-                            {
-                              "value": "3",
-                              "text": "Neither agree nor disagree"
-                            },
-                            {
-                              "value": "4",
-                              "text": "Agree"
-                            },
-                            {
-                              "value": "5",
-                              "text": "Strongly agree"
-                            }
-                          ],
-                          "rows": [
-                            {
-                              "value": "",
-                              "text": ""
-                            }
-                          ]
-                        }
-                      ]
-                    }
-                  ]
-                }
-            ),
+            control=RatingSurveyControl(),
             # events={
             #     "responseEnable": Event(is_triggered_by="promptStart"),
             #     "submitEnable": Event(is_triggered_by="promptEnd"),
@@ -273,10 +229,143 @@ class RateTrial(StaticTrial):
 class RateTrialMaker(StaticTrialMaker):
     give_end_feedback_passed = False
 
+    _network_ids = None
+    _render_urls = None
+
+    def index_nodes(self) -> None:
+        """Maps each stimulus key to its network ID and render URLs (cached, as nodes don't change once deployed)"""
+        network_ids, render_urls = {}, {}
+        for node in StaticNode.query.filter_by(trial_maker_id=self.id):
+            key = node.definition["stimulus"]
+            network_ids[key] = node.network_id
+            render_urls[key] = {
+                name: asset_url(asset) if IMMUTABLE_ASSET_URLS else asset.url for name, asset in node.assets.items()
+            }
+        self._network_ids, self._render_urls = network_ids, render_urls
+
+    def get_network_ids(self) -> dict:
+        if self._network_ids is None:
+            self.index_nodes()
+        return self._network_ids
+
+    def get_render_url(self, key: str, asset_name: str = "render") -> str:
+        """The URL of a stimulus' render, or of the given rendition of it if that was built"""
+        if self._render_urls is None:
+            self.index_nodes()
+        urls = self._render_urls[key]
+        return urls.get(asset_name, urls["render"])
+
+    def get_next_render_url(self, participant, experiment, trial, asset_name: str = "render") -> Optional[str]:
+        """The render of the participant's next trial, taken from their schedule block or else reserved in advance"""
+        if not SCHEDULED_ALLOCATION or participant.var.get("schedule_block", None) is None:
+            network = self.reserve_next_network(participant, experiment, trial)
+            return None if network is None else self.get_render_url(network.head.definition["stimulus"], asset_name)
+        block = load_schedule()[participant.var.get("schedule_block")]
+        # `find_networks` has already moved the position past the current trial
+        position = participant.var.get("schedule_position")
+        if position >= len(block):
+            return None
+        return self.get_render_url(block[position], asset_name)
+
+    def reserve_next_network(self, participant, experiment, trial):
+        """Chooses the participant's next network while they are on `trial`, so that its render can be prefetched.
+
+        `find_networks` then hands out the reserved network, unless it has become unavailable in the meantime.
+        """
+        reserved = participant.var.get("next_network", None)
+        if reserved is not None and reserved["after_trial"] == trial.id:
+            return self.network_class.query.get(reserved["network_id"])
+        if participant.module_state.n_completed_trials + 1 >= self.max_trials_per_participant:
+            return None
+        # The parent returns the one network it chose, or "wait" or "exit"
+        networks = super().find_networks(participant, experiment)
+        if isinstance(networks, str):
+            return None
+        network = networks[0]
+        participant.var.set("next_network", {"after_trial": trial.id, "network_id": network.id})
+        return network
+
+    def custom_network_filter(self, candidates, participant):
+        # The network of the trial in progress only counts as participated in once that trial is finalized, which is
+        # after the next network has been reserved (by then, excluding it changes nothing)
+        current_trial = participant.current_trial
+        if current_trial is None:
+            return candidates
+        return [network for network in candidates if network.id != current_trial.network_id]
+
+    def finalize_trial(self, answer, trial, experiment, participant):
+        super().finalize_trial(answer, trial, experiment, participant)
+        # Lock the node's row so that concurrent responses to the same stimulus don't overwrite each other's update
+        node = StaticNode.query.with_for_update().populate_existing().get(trial.node_id)
+        update_node_stats(node, answer)
+
+    def is_available(self, network, participant) -> bool:
+        """The parent's checks, for a single network: not full or failed, in the participant's group, not rated by
+        them yet, and with room at its head"""
+        module_state = participant.module_state
+        return (
+            not network.full
+            and not network.failed
+            and network.participant_group == module_state.participant_group
+            and (
+                self.allow_revisiting_networks_in_across_chains
+                or network.id not in module_state.participated_networks
+            )
+            and network.head is not None
+            and network.n_viable_trials_at_head < self.trials_per_node
+        )
+
+    def find_networks(self, participant, experiment, *args, **kwargs):
+        if participant.module_state.n_completed_trials >= self.max_trials_per_participant:
+            return "exit"
+        if SCHEDULED_ALLOCATION:
+            if not participant.var.has("schedule_block"):
+                participant.var.set("schedule_block", claim_block())
+                participant.var.set("schedule_position", 0)
+            if participant.var.get("schedule_block") is not None:
+                return self.find_scheduled_networks(participant)
+        # Balanced allocation, which scheduled allocation also falls back to once every block has been claimed
+        reserved = participant.var.get("next_network", None)
+        if reserved is not None:
+            participant.var.set("next_network", None)
+            network = self.network_class.query.get(reserved["network_id"])
+            if self.is_available(network, participant):
+                return [network]
+        return super().find_networks(participant, experiment, *args, **kwargs)
+
+    def find_scheduled_networks(self, participant):
+        """The next available network of the participant's schedule block, or "exit" once the block is used up"""
+        block = load_schedule()[participant.var.get("schedule_block")]
+        position = participant.var.get("schedule_position")
+        # Stimuli that became unavailable (e.g. filled up by participants who fell back to balanced allocation) are
+        # skipped, so the participant may be given fewer trials than the block holds
+        while position < len(block):
+            network = self.network_class.query.get(self.get_network_ids()[block[position]])
+            position += 1
+            if self.is_available(network, participant):
+                participant.var.set("schedule_position", position)
+                return [network]
+        participant.var.set("schedule_position", position)
+        return "exit"
+
+    def fail_participant_trials(self, participant, reason=None):
+        super().fail_participant_trials(participant, reason=reason)
+        # The failed trials are redone by whoever claims the block next, which keeps the allocation balanced
+        block = participant.var.get("schedule_block", None)
+        if SCHEDULED_ALLOCATION and block is not None:
+            release_block(block)
+            # Not deleted, so that a re-entry falls back to balanced allocation instead of claiming another block
+            participant.var.set("schedule_block", None)
+
+
+# Node selection (with `balance_across_nodes`) happens in `find_networks`, within the whole of `prepare_trial`
+instrument(RateTrialMaker, "find_networks", "node_selection")
+instrument(RateTrialMaker, "prepare_trial")
+
 
 class Exp(psynet.experiment.Experiment):
     label = "Jazz music generation listening test"
-    asset_storage = LocalStorage()
+    asset_storage = LinkedLocalStorage()
     max_exp_dir_size_in_mb = 1000000000
     config = {
         "currency": "£",
@@ -285,9 +374,17 @@ class Exp(psynet.experiment.Experiment):
         "window_height": 1024,
     }
     timeline = Timeline(
+        PreDeployRoutine("build_renditions", build_renditions, {"extra": (VOLUME_CALIBRATION_AUDIO,)}),
+        PreDeployRoutine("refresh_asset_manifest", refresh_manifest),
+        PreDeployRoutine("check_loudness", check_render_loudness, {"reference": VOLUME_CALIBRATION_AUDIO}),
+        *([PreDeployRoutine(
+            "write_schedule",
+            write_deployment_schedule,
+            {"block_size": TRIALS_PER_PARTICIPANT, "n_cycles": TRIALS_PER_PARTICIPANT}
+        )] if SCHEDULED_ALLOCATION else []),
         consent(),
         experiment_requirements(),
-        AudioCalibration(audio=VOLUME_CALIBRATION_AUDIO),
+        audio_calibration(VOLUME_CALIBRATION_AUDIO),
         instructions(),
         RateTrialMaker(
             id_="main_experiment",
@@ -309,3 +406,41 @@ class Exp(psynet.experiment.Experiment):
         debriefing(),
         SuccessfulEndPage(),
     )
+
+    def test_check_bot(self, bot, **kwargs):
+        super().test_check_bot(bot, **kwargs)
+        trials = RateTrial.query.filter_by(participant_id=bot.id, failed=False).all()
+        if SCHEDULED_ALLOCATION:
+            # Scheduled stimuli that became unavailable are skipped (see `find_scheduled_networks`), so a bot may
+            # finish its block with fewer trials
+            assert len(trials) <= TRIALS_PER_PARTICIPANT
+        else:
+            assert len(trials) == TRIALS_PER_PARTICIPANT
+        assert all(trial.complete for trial in trials)
+        # No stimulus is rated twice by the same participant
+        assert len({trial.node_id for trial in trials}) == len(trials)
+
+    @experiment_route("/hot_path_timings", methods=["GET"])
+    @classmethod
+    def hot_path_timings(cls):
+        """Per-stage timings of the current process, if started with HOT_PATH_PROFILING=1 (dashboard login required)"""
+        if not authenticate(request.authorization, get_config()):
+            return jsonify({"message": "Invalid credentials"}), 401
+        return summary()
+
+    @experiment_route(IMMUTABLE_ROUTE + "/<digest>/<path:host_path>", methods=["GET"])
+    @classmethod
+    def immutable_asset(cls, digest, host_path):
+        """Serves a deposited asset from its content-hashed URL (see `asset_server`)"""
+        if not is_safe_path(host_path):
+            abort(404)
+        return serve_immutable(os.path.expanduser(cls.asset_storage.get_file_system_path(host_path)), digest)
+
+    @experiment_route("/rating_summary", methods=["GET"])
+    @classmethod
+    def rating_summary(cls):
+        """Running rating statistics per stimulus and condition, without failed trials (dashboard login required)"""
+        if not authenticate(request.authorization, get_config()):
+            return jsonify({"message": "Invalid credentials"}), 401
+        nodes = StaticNode.query.filter_by(trial_maker_id="main_experiment")
+        return summary_tables(nodes)
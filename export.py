@@ -0,0 +1,316 @@
+import ast
+import datetime
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Iterator, Optional, Union
+
+EXPORT_PATH = "dallinger-export.json"
+INCREMENTAL_DIR = "export"
+WATERMARK_FILE = "watermark.json"
+# How far back each incremental run re-reads, as a response can commit after responses with higher IDs
+OVERLAP_SECONDS = 10 * 60
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+CHUNK_SIZE = 1024 * 1024
+
+# Fields that the export stores as Python reprs rather than JSON
+LITERAL_FIELDS = ("metadata_", "vars")
+
+# Matches the tokens that differ between a Python repr and JSON. Strings are matched as whole tokens first,
+# so that e.g. a `None` inside a string is left alone
+_LITERAL_TOKEN = re.compile(r"""'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*"|\b(?:None|True|False|nan|inf)\b""")
+_STRING_ESCAPE = re.compile(r"\\(x[0-9a-fA-F]{2}|U[0-9a-fA-F]{8}|'|.)", re.DOTALL)
+_SWAP_QUOTES = str.maketrans("'", '"')
+_CONSTANTS = {"None": "null", "True": "true", "False": "false", "nan": "NaN", "inf": "Infinity"}
+
+
+def _as_filter(values) -> Optional[set]:
+    """Normalises a filter argument (a single value or a collection of values) to a set of strings"""
+    if values is None:
+        return None
+    if isinstance(values, (str, int)):
+        values = [values]
+    return {str(v) for v in values}
+
+
+def iter_json_array(path: str, chunk_size: int = CHUNK_SIZE) -> Iterator[dict]:
+    """Yields the elements of a top-level JSON array one at a time, reading the file in fixed-size chunks"""
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        buffer, pos, eof = "", 0, False
+        started = False
+        while True:
+            # Skip whitespace and separators between elements
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buffer) and not started:
+                if buffer[pos] != "[":
+                    raise ValueError(f"{path} does not contain a JSON array")
+                started = True
+                pos += 1
+                continue
+            if pos < len(buffer) and buffer[pos] == "]":
+                return
+            if pos < len(buffer):
+                try:
+                    obj, pos = decoder.raw_decode(buffer, pos)
+                    yield obj
+                    continue
+                # The element is cut off at the end of the buffer, so we need to read more
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+            elif eof:
+                raise ValueError(f"{path} ended before the JSON array was closed")
+            chunk = f.read(chunk_size)
+            eof = not chunk
+            # Drop everything we've already parsed so that memory only grows with the size of one element
+            buffer, pos = buffer[pos:] + chunk, 0
+
+
+def iter_json_lines(directory: str) -> Iterator[dict]:
+    """Yields the records of an incremental export, one partition file after another"""
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(".jsonl"):
+            continue
+        with open(os.path.join(directory, name), "r", encoding="utf-8") as f:
+            for line in f:
+                yield json.loads(line)
+
+
+def iter_records(
+        path: str = EXPORT_PATH,
+        question: Union[None, str, Iterable[str]] = None,
+        participant_id: Union[None, int, str, Iterable[Union[int, str]]] = None,
+        chunk_size: int = CHUNK_SIZE
+) -> Iterator[dict]:
+    """Streams records from an export, optionally keeping only those for the given question(s) and participant(s).
+
+    `path` can be a full export (a JSON array) or the directory of an incremental export.
+    """
+    questions, participants = _as_filter(question), _as_filter(participant_id)
+    records = iter_json_lines(path) if os.path.isdir(path) else iter_json_array(path, chunk_size)
+    for record in records:
+        if questions is not None and record.get("question") not in questions:
+            continue
+        if participants is not None and str(record.get("participant_id")) not in participants:
+            continue
+        yield record
+
+
+def _convert_escape(match: re.Match) -> str:
+    escape = match.group(1)
+    if escape[0] == "x":
+        return "\\u00" + escape[1:]
+    if escape[0] == "U":
+        # JSON has no 8-digit escape, so write the character itself
+        return json.dumps(chr(int(escape[1:], 16)))[1:-1]
+    if escape == "'":
+        return "'"
+    return match.group(0)
+
+
+def _convert_token(match: re.Match) -> str:
+    token = match.group(0)
+    if token[0] == "'":
+        # Python only uses single quotes when the string contains no unescaped double quotes of its own
+        content = token[1:-1].replace('"', '\\"')
+        if "\\" in content:
+            content = _STRING_ESCAPE.sub(_convert_escape, content)
+        return '"' + content + '"'
+    if token[0] == '"':
+        if "\\" in token:
+            return '"' + _STRING_ESCAPE.sub(_convert_escape, token[1:-1]) + '"'
+        return token
+    return _CONSTANTS[token]
+
+
+def _fast_convert(text: str) -> Optional[str]:
+    """Converts the common case of a repr to JSON using only C-level string operations, or returns None.
+
+    If a repr contains no double quotes, every string in it is single-quoted and contains no quotes of its own.
+    Its escapes are then valid JSON unless they are \\x, \\U or \\' escapes, so swapping the quotes is enough.
+    """
+    if '"' in text or "\\'" in text or "\\x" in text or "\\U" in text:
+        return None
+    swapped = text.translate(_SWAP_QUOTES)
+    parts = swapped.split('"')
+    inside, outside = "".join(parts[1::2]), "".join(parts[0::2])
+    # Constants can only be replaced wholesale if they don't also appear inside strings
+    if "None" in inside or "True" in inside or "False" in inside or "nan" in outside or "inf" in outside:
+        return None
+    return swapped.replace("None", "null").replace("True", "true").replace("False", "false")
+
+
+def decode_python_literal(text: str):
+    """Decodes a Python repr (as stored in the export's `metadata_` and `vars` fields) without eval.
+
+    The repr is translated to JSON and parsed with the C JSON decoder. Anything that has no JSON equivalent
+    (tuples, sets, non-string keys...) falls back to `ast.literal_eval`.
+    """
+    converted = _fast_convert(text)
+    if converted is None:
+        converted = _LITERAL_TOKEN.sub(_convert_token, text)
+    try:
+        return json.loads(converted)
+    except ValueError:
+        return ast.literal_eval(text)
+
+
+def decode_answer(text: Optional[str]):
+    """Decodes an answer, which is a repr of a dict or list for some pages (e.g. `rating`) and plain text for others.
+
+    Anything else is left as text, so that free-text answers such as "25" or "None" are kept as written.
+    """
+    if not isinstance(text, str) or not text.startswith(("{", "[")):
+        return text
+    try:
+        return decode_python_literal(text)
+    except (ValueError, SyntaxError):
+        return text
+
+
+def decode_record(record: dict, fields: Iterable[str] = LITERAL_FIELDS) -> dict:
+    """Returns a copy of an export record with the given Python-repr fields and its answer decoded"""
+    decoded = dict(record)
+    for field in fields:
+        if isinstance(decoded.get(field), str):
+            decoded[field] = decode_python_literal(decoded[field])
+    decoded["answer"] = decode_answer(decoded.get("answer"))
+    return decoded
+
+
+def _decode_batch(batch: list, fields: tuple) -> list:
+    return [decode_record(record, fields) for record in batch]
+
+
+def decode_records(
+        records: Iterable[dict],
+        fields: Iterable[str] = LITERAL_FIELDS,
+        n_workers: int = None,
+        batch_size: int = 256
+) -> Iterator[dict]:
+    """Decodes the Python-repr fields of many records in a pool of worker processes, preserving their order"""
+    fields = tuple(fields)
+    batches, batch = [], []
+    for record in records:
+        batch.append(record)
+        if len(batch) == batch_size:
+            batches.append(batch)
+            batch = []
+    if batch:
+        batches.append(batch)
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        for decoded in pool.map(_decode_batch, batches, [fields] * len(batches)):
+            yield from decoded
+
+
+def export_value(value) -> str:
+    """Formats a database value as a string, in the same way as the full export"""
+    if value is None:
+        return "null"
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, datetime.datetime):
+        return value.strftime(TIME_FORMAT)
+    if isinstance(value, (dict, list)):
+        return repr(value)
+    return str(value)
+
+
+def load_watermark(out_dir: str = INCREMENTAL_DIR) -> dict:
+    """Loads the highest exported response ID and creation time, the IDs (with their creation times) exported within
+    the overlap window, and the size of each partition file when it was exported"""
+    try:
+        with open(os.path.join(out_dir, WATERMARK_FILE), "r") as f:
+            watermark = json.load(f)
+    except FileNotFoundError:
+        watermark = {"id": 0, "creation_time": None, "sizes": {}}
+    watermark.setdefault("recent", {})
+    return watermark
+
+
+def export_incremental(
+        out_dir: str = INCREMENTAL_DIR,
+        batch_size: int = 1000,
+        overlap_seconds: float = OVERLAP_SECONDS
+) -> int:
+    """Appends the responses added since the last run to one JSON-lines file per day, returning how many there were.
+
+    IDs are assigned when a row is inserted but the row only becomes visible when its transaction commits, so a
+    response can appear after others with higher IDs. Each run therefore reads the rows above the watermark ID plus
+    those created within `overlap_seconds` of the latest exported one, and skips the IDs it exported in that window
+    before. Records are built with `to_dict`, as in PsyNet's own export, and formatted as in the full export.
+
+    The watermark is moved only once the rows are on disk; rows appended by a run that failed before then are
+    truncated away by the next run, so no response is written twice.
+    """
+    from sqlalchemy import or_
+    from sqlalchemy.orm import undefer
+    from psynet.timeline import Response
+
+    os.makedirs(out_dir, exist_ok=True)
+    watermark = load_watermark(out_dir)
+    for partition, size in watermark["sizes"].items():
+        path = os.path.join(out_dir, partition)
+        if os.path.exists(path) and os.path.getsize(path) > size:
+            os.truncate(path, size)
+    new_rows = Response.id > watermark["id"]
+    if watermark["creation_time"] is not None:
+        cutoff = datetime.datetime.strptime(watermark["creation_time"], TIME_FORMAT)
+        new_rows = or_(new_rows, Response.creation_time >= cutoff - datetime.timedelta(seconds=overlap_seconds))
+    # `vars` is a deferred column, which would otherwise be loaded with one query per response
+    query = Response.query.filter(new_rows).options(undefer(Response.vars)).order_by(Response.id).yield_per(batch_size)
+    recent = watermark["recent"]
+    files, n_exported = {}, 0
+    try:
+        for response in query:
+            if str(response.id) in recent:
+                continue
+            record = {key: export_value(value) for key, value in response.to_dict().items()}
+            partition = response.creation_time.strftime("%Y-%m-%d") + ".jsonl"
+            if partition not in files:
+                files[partition] = open(os.path.join(out_dir, partition), "a", encoding="utf-8")
+            files[partition].write(json.dumps(record) + "\n")
+            recent[str(response.id)] = record["creation_time"]
+            watermark["id"] = max(watermark["id"], response.id)
+            watermark["creation_time"] = max(watermark["creation_time"] or "", record["creation_time"])
+            n_exported += 1
+    finally:
+        for partition, f in files.items():
+            f.flush()
+            os.fsync(f.fileno())
+            f.close()
+            watermark["sizes"][partition] = os.path.getsize(os.path.join(out_dir, partition))
+    if watermark["creation_time"] is not None:
+        # Only IDs that the next run's window can still reach need remembering
+        cutoff = datetime.datetime.strptime(watermark["creation_time"], TIME_FORMAT)
+        oldest = (cutoff - datetime.timedelta(seconds=overlap_seconds)).strftime(TIME_FORMAT)
+        watermark["recent"] = {i: time for i, time in recent.items() if time >= oldest}
+    tmp_path = os.path.join(out_dir, WATERMARK_FILE + f".{os.getpid()}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(watermark, f)
+    os.replace(tmp_path, os.path.join(out_dir, WATERMARK_FILE))
+    return n_exported
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Stream records from an export as JSON lines")
+    parser.add_argument("path", nargs="?", default=EXPORT_PATH)
+    parser.add_argument(
+        "--incremental",
+        metavar="OUT_DIR",
+        help="Instead, append the responses added to the database since the last run to OUT_DIR"
+    )
+    parser.add_argument("--question", action="append", help="Only keep records for this question (repeatable)")
+    parser.add_argument("--participant-id", action="append", help="Only keep records for this participant (repeatable)")
+    args = parser.parse_args()
+    if args.incremental:
+        print(f"Exported {export_incremental(args.incremental)} new responses to {args.incremental}", file=sys.stderr)
+        sys.exit()
+    for rec in iter_records(args.path, question=args.question, participant_id=args.participant_id):
+        sys.stdout.write(json.dumps(rec) + "\n")
@@ -2,8 +2,14 @@ from dominate import tags
 
 from psynet.page import InfoPage
 
+try:
+    from .static_html import static_html
+except ImportError:
+    from static_html import static_html
 
-def instructions():
+
+@static_html
+def instructions_html():
     html = tags.div()
 
     with html:
@@ -96,4 +102,8 @@ def instructions():
             """
         )
 
-    return InfoPage(html, time_estimate=15)
+    return html
+
+
+def instructions():
+    return InfoPage(instructions_html(), time_estimate=15)
@@ -0,0 +1,102 @@
+"""Load test that drives concurrent bot participants through the whole timeline.
+
+Bots call the experiment's server code directly (as in `test.py`), so page latencies measure the server side of each
+page, including contention for the database and Redis. Run with e.g. `LOAD_TEST_BOTS=50 bash docker/run pytest -s
+test.py -k load`, which launches the experiment against the local Postgres and Redis services.
+"""
+
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from dallinger import db
+from psynet.bot import Bot
+from psynet.utils import get_logger
+
+logger = get_logger()
+
+PERCENTILES = (50, 95, 99)
+
+
+class LoadTestResults:
+    """Page latencies per timeline stage, completed participants and errors, collected from many bot threads"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.completed = 0
+        self.errors = []
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.latencies[stage].append(seconds)
+
+    def finish(self) -> None:
+        with self._lock:
+            self.completed += 1
+
+    def fail(self, error: Exception) -> None:
+        with self._lock:
+            self.errors.append(f"{type(error).__name__}: {error}")
+
+
+def run_bot(results: LoadTestResults, render_pages: bool = True) -> None:
+    """Takes one bot through the timeline, timing every page it submits"""
+    try:
+        bot = Bot()
+        db.session.commit()
+        while bot.status == "working":
+            page = bot.get_current_page()
+            # Pages inside a module (e.g. the trial maker) are grouped under the module, the rest under their label
+            stage = bot.module_id or page.label
+            start = time.perf_counter()
+            bot.take_page(page, render_page=render_pages)
+            db.session.commit()
+            results.record(stage, time.perf_counter() - start)
+        results.finish()
+    except Exception as error:
+        logger.exception("Load test bot failed")
+        db.session.rollback()
+        results.fail(error)
+    finally:
+        # Each thread has its own scoped session, which must be released before the thread is reused
+        db.session.remove()
+
+
+def run_load_test(n_bots: int, n_workers: int = None, render_pages: bool = True) -> dict:
+    """Runs `n_bots` bots, `n_workers` at a time (by default all at once), and summarises the results"""
+    results = LoadTestResults()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=n_workers or n_bots) as pool:
+        for _ in range(n_bots):
+            pool.submit(run_bot, results, render_pages)
+    elapsed = time.perf_counter() - start
+    stages = {}
+    for stage, latencies in results.latencies.items():
+        stats = {"n": len(latencies)}
+        for q, value in zip(PERCENTILES, np.percentile(latencies, PERCENTILES)):
+            stats[f"p{q}_ms"] = value * 1000
+        stages[stage] = stats
+    return {
+        "n_bots": n_bots,
+        "completed": results.completed,
+        "elapsed_seconds": elapsed,
+        "participants_per_minute": results.completed / elapsed * 60,
+        "stages": stages,
+        "errors": results.errors,
+    }
+
+
+def format_report(report: dict) -> str:
+    """Formats the output of `run_load_test` as plain text"""
+    lines = [
+        f"{report['completed']}/{report['n_bots']} participants completed in {report['elapsed_seconds']:.1f} s "
+        f"({report['participants_per_minute']:.1f} participants/min), {len(report['errors'])} errors",
+        f"{'stage':<32}{'n':>8}" + "".join(f"{f'p{q}_ms':>12}" for q in PERCENTILES),
+    ]
+    for stage, stats in report["stages"].items():
+        lines.append(f"{stage:<32}{stats['n']:>8}" + "".join(f"{stats[f'p{q}_ms']:>12.1f}" for q in PERCENTILES))
+    lines.extend(report["errors"])
+    return "\n".join(lines)
@@ -0,0 +1,191 @@
+import json
+import os
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+try:
+    from .asset_manifest import build_manifest, md5_file
+    from .catalogue import AUDIO_DIR
+    from .renditions import CALIBRATION_AUDIO
+except ImportError:
+    from asset_manifest import build_manifest, md5_file
+    from catalogue import AUDIO_DIR
+    from renditions import CALIBRATION_AUDIO
+
+FEATURE_INDEX_PATH = "assets/loudness.json"
+SAMPLE_RATE = 48000
+SILENCE_THRESHOLD_DB = -60.0
+# Robust z-score (from the median and MAD over all renders) beyond which a feature is flagged
+OUTLIER_THRESHOLD = 3.5
+# Smallest spread used for the z-scores, in each feature's units, so that a loudness-normalised corpus doesn't flag
+# differences that no one could hear
+MIN_SPREAD = {"loudness_lufs": 0.5, "peak_dbfs": 0.5, "duration": 0.5, "leading_silence": 0.1, "trailing_silence": 0.1}
+# Largest difference (in LU) between a render's integrated loudness and the calibration audio's. Participants set
+# their volume on the calibration audio, so renders should play back at about the same loudness
+REFERENCE_TOLERANCE_LU = 2.0
+FEATURES = ["loudness_lufs", "peak_dbfs", "duration", "leading_silence", "trailing_silence"]
+
+# ITU-R BS.1770 K-weighting at 48 kHz: a high-shelf followed by a high-pass biquad, as (b, a) coefficients
+K_WEIGHTING = [
+    ([1.53512485958697, -2.69169618940638, 1.19839281085285], [1.0, -1.69065929318241, 0.73248077421585]),
+    ([1.0, -2.0, 1.0], [1.0, -1.99004745483398, 0.99007225036621]),
+]
+
+
+def decode(path: str) -> np.ndarray:
+    """Decodes an audio file with ffmpeg to a (n_samples, n_channels) float32 array at 48 kHz"""
+    output = subprocess.run(
+        ["ffmpeg", "-nostdin", "-loglevel", "error", "-i", path, "-vn", "-f", "f32le", "-ar", str(SAMPLE_RATE), "-"],
+        check=True,
+        capture_output=True
+    ).stdout
+    n_channels = int(subprocess.run(
+        ["ffprobe", "-v", "error", "-select_streams", "a:0", "-show_entries", "stream=channels", "-of", "csv=p=0", path],
+        check=True,
+        capture_output=True,
+        text=True
+    ).stdout.strip())
+    return np.frombuffer(output, dtype=np.float32).reshape(-1, n_channels)
+
+
+def k_weight(samples: np.ndarray) -> np.ndarray:
+    """Applies K-weighting to every channel at once, by multiplying by the filters' frequency response"""
+    n = 2 * len(samples)    # zero-padding keeps the circular convolution from wrapping the filter's tail around
+    z = np.exp(-2j * np.pi * np.fft.rfftfreq(n, 1 / SAMPLE_RATE) / SAMPLE_RATE)
+    response = np.ones_like(z)
+    for b, a in K_WEIGHTING:
+        response *= np.polyval(b[::-1], z) / np.polyval(a[::-1], z)
+    return np.fft.irfft(np.fft.rfft(samples, n=n, axis=0) * response[:, None], n=n, axis=0)[:len(samples)]
+
+
+def integrated_loudness(samples: np.ndarray) -> float:
+    """Gated integrated loudness (LUFS) following ITU-R BS.1770-4, for mono or stereo audio"""
+    block, step = int(0.4 * SAMPLE_RATE), int(0.1 * SAMPLE_RATE)
+    if len(samples) < block:
+        return float("-inf")
+    # Mean square of each 400 ms block (with 75% overlap) from the running sum of squares, summed over channels
+    energy = np.concatenate([np.zeros((1, samples.shape[1])), np.cumsum(k_weight(samples) ** 2, axis=0)])
+    starts = np.arange(0, len(samples) - block + 1, step)
+    power = ((energy[starts + block] - energy[starts]) / block).sum(axis=1)
+    with np.errstate(divide="ignore"):
+        loudness = -0.691 + 10 * np.log10(power)
+    gated = power[loudness > -70]
+    if not len(gated):
+        return float("-inf")
+    relative_gate = -0.691 + 10 * np.log10(gated.mean()) - 10
+    gated = gated[-0.691 + 10 * np.log10(gated) > relative_gate]
+    return float(-0.691 + 10 * np.log10(gated.mean()))
+
+
+def analyse(samples: np.ndarray) -> dict:
+    """Computes the loudness features of decoded audio"""
+    magnitude = np.abs(samples).max(axis=1)
+    audible = np.flatnonzero(magnitude > 10 ** (SILENCE_THRESHOLD_DB / 20))
+    peak = magnitude.max(initial=0)
+    with np.errstate(divide="ignore"):
+        peak_dbfs = float(20 * np.log10(peak))
+    return {
+        "loudness_lufs": integrated_loudness(samples),
+        "peak_dbfs": peak_dbfs,
+        "duration": len(samples) / SAMPLE_RATE,
+        "leading_silence": float(audible[0] if len(audible) else len(samples)) / SAMPLE_RATE,
+        "trailing_silence": float(len(samples) - 1 - audible[-1] if len(audible) else len(samples)) / SAMPLE_RATE,
+    }
+
+
+def analyse_file(path: str) -> dict:
+    return analyse(decode(path))
+
+
+def load_feature_index(index_path: str = FEATURE_INDEX_PATH) -> dict:
+    """Loads the index of digest -> features, or an empty index if none has been written yet"""
+    try:
+        with open(index_path, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def build_feature_index(
+        audio_dir: str = AUDIO_DIR,
+        extra: tuple = (CALIBRATION_AUDIO,),
+        index_path: str = FEATURE_INDEX_PATH,
+        n_workers: int = None
+) -> dict:
+    """Returns path -> features for every render, decoding only files whose digest isn't in the index yet"""
+    # The manifest only rehashes files that have changed, so unchanged renders cost nothing here
+    digests = {path: entry["digest"] for path, entry in build_manifest(audio_dir).items()}
+    digests.update({os.path.normpath(path): md5_file(path) for path in extra})
+    index = load_feature_index(index_path)
+    to_decode = sorted({path for path, digest in digests.items() if digest not in index})
+    if to_decode:
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            for path, features in zip(to_decode, pool.map(analyse_file, to_decode)):
+                index[digests[path]] = features
+    # Drop features of files that no longer exist, so that the index doesn't grow with every edit
+    index = {digest: index[digest] for digest in set(digests.values())}
+    tmp_path = index_path + f".{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(index, f, indent=1)
+    os.replace(tmp_path, index_path)
+    return {path: index[digest] for path, digest in digests.items()}
+
+
+def find_outliers(features: dict, reference: str = CALIBRATION_AUDIO, threshold: float = OUTLIER_THRESHOLD) -> dict:
+    """Returns path -> [(feature, value, robust z-score)] for renders whose features stand out from the rest"""
+    renders = sorted(path for path in features if path != os.path.normpath(reference))
+    outliers = {}
+    for feature in FEATURES:
+        values = np.array([features[path][feature] for path in renders], dtype=float)
+        finite = np.isfinite(values)
+        median = np.median(values[finite])
+        # 1.4826 scales the MAD to the standard deviation of a normal distribution
+        spread = max(1.4826 * np.median(np.abs(values[finite] - median)), MIN_SPREAD[feature])
+        scores = np.where(finite, (values - median) / spread, np.inf)
+        for i in np.flatnonzero(np.abs(scores) > threshold):
+            outliers.setdefault(renders[i], []).append((feature, float(values[i]), float(scores[i])))
+    return outliers
+
+
+def reference_mismatches(
+        features: dict,
+        reference: str = CALIBRATION_AUDIO,
+        tolerance: float = REFERENCE_TOLERANCE_LU
+) -> dict:
+    """Returns path -> difference in LU from the calibration audio, for renders further than `tolerance` from it"""
+    reference_loudness = features[os.path.normpath(reference)]["loudness_lufs"]
+    renders = [path for path in features if path != os.path.normpath(reference)]
+    differences = {path: features[path]["loudness_lufs"] - reference_loudness for path in renders}
+    # NaN differences (silent files) fail the comparison, so they are reported too
+    return {path: difference for path, difference in sorted(differences.items()) if not abs(difference) <= tolerance}
+
+
+def check_loudness(audio_dir: str = AUDIO_DIR, reference: str = CALIBRATION_AUDIO) -> None:
+    """Pre-deployment routine that updates the feature index and logs any renders that don't match the calibration
+    audio's loudness or that stand out from the rest"""
+    from psynet.utils import get_logger
+
+    logger = get_logger()
+    features = build_feature_index(audio_dir, extra=(reference,))
+    renders = [f["loudness_lufs"] for path, f in features.items() if path != os.path.normpath(reference)]
+    reference_loudness = features[os.path.normpath(reference)]["loudness_lufs"]
+    logger.info(
+        "Median render loudness is %.1f LUFS; the calibration audio is %.1f LUFS",
+        np.median(renders), reference_loudness
+    )
+    for path, difference in reference_mismatches(features, reference).items():
+        logger.warning("%s is %+.1f LU from the calibration audio", path, difference)
+    for path, flagged in find_outliers(features, reference).items():
+        logger.warning("%s stands out: %s", path, ", ".join(f"{f} = {v:.2f} (z = {z:.1f})" for f, v, z in flagged))
+
+
+if __name__ == "__main__":
+    built = build_feature_index()
+    reference_path = os.path.normpath(CALIBRATION_AUDIO)
+    print(f"{len(built)} files, calibration audio at {built[reference_path]['loudness_lufs']:.1f} LUFS")
+    for mismatch, lu in reference_mismatches(built).items():
+        print(f"{mismatch} is {lu:+.1f} LU from the calibration audio")
+    for outlier, flags in find_outliers(built).items():
+        print(outlier, ", ".join(f"{f} = {v:.2f} (z = {z:.1f})" for f, v, z in flags))
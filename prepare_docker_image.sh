@@ -0,0 +1,2 @@
+# ffmpeg is used to transcode the audio renditions (see renditions.py)
+apt-get update && apt-get install -y --no-install-recommends ffmpeg && rm -rf /var/lib/apt/lists/*
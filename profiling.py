@@ -0,0 +1,95 @@
+import atexit
+import functools
+import os
+import sys
+import time
+from collections import deque
+
+from psynet.utils import get_logger
+
+logger = get_logger()
+
+# Off by default: when disabled, `timed` and `instrument` leave the code they are given untouched
+ENABLED = os.environ.get("HOT_PATH_PROFILING", "0") == "1"
+BUFFER_SIZE = int(os.environ.get("HOT_PATH_PROFILING_BUFFER", "4096"))
+PERCENTILES = (50, 95, 99)
+
+# Stage -> ring buffer of (wall time in ns, net allocated blocks) for the most recent calls
+_samples = {}
+
+
+def record(stage: str, duration_ns: int, allocated_blocks: int) -> None:
+    """Adds one call to the ring buffer of the given stage, dropping the oldest call once it is full"""
+    samples = _samples.get(stage)
+    if samples is None:
+        # setdefault is atomic, so concurrent requests can't end up with two buffers for the same stage
+        samples = _samples.setdefault(stage, deque(maxlen=BUFFER_SIZE))
+    samples.append((duration_ns, allocated_blocks))
+
+
+def timed(stage: str):
+    """Decorator that records the wall time and net allocated memory blocks of every call under `stage`"""
+    def decorator(func):
+        if not ENABLED:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            blocks = sys.getallocatedblocks()
+            start = time.perf_counter_ns()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(stage, time.perf_counter_ns() - start, sys.getallocatedblocks() - blocks)
+        return wrapper
+    return decorator
+
+
+def instrument(cls: type, name: str, stage: str = None) -> None:
+    """Times a method that `cls` inherits from PsyNet, without overriding it when profiling is off"""
+    if ENABLED:
+        setattr(cls, name, timed(stage or name)(getattr(cls, name)))
+
+
+def _percentile(values: list, q: float):
+    """Nearest-rank percentile of already sorted values"""
+    return values[min(len(values) - 1, max(0, -(-len(values) * q // 100) - 1))]
+
+
+def summary() -> dict:
+    """Returns the call count and p50/p95/p99 wall time (ms) and net allocated blocks for each stage"""
+    result = {}
+    for stage, samples in sorted(_samples.items()):
+        samples = list(samples)
+        if not samples:
+            continue
+        durations = sorted(s[0] for s in samples)
+        blocks = sorted(s[1] for s in samples)
+        stats = {"n": len(samples)}
+        for q in PERCENTILES:
+            stats[f"p{q}_ms"] = _percentile(durations, q) / 1e6
+        for q in PERCENTILES:
+            stats[f"p{q}_blocks"] = _percentile(blocks, q)
+        result[stage] = stats
+    return result
+
+
+def format_summary(stats: dict = None) -> str:
+    """Formats a summary as a plain-text table"""
+    stats = summary() if stats is None else stats
+    columns = ["n", *(f"p{q}_ms" for q in PERCENTILES), *(f"p{q}_blocks" for q in PERCENTILES)]
+    lines = [f"{'stage':<24}" + "".join(f"{c:>12}" for c in columns)]
+    for stage, row in stats.items():
+        lines.append(f"{stage:<24}" + "".join(
+            f"{row[c]:>12.3f}" if c.endswith("_ms") else f"{row[c]:>12}" for c in columns
+        ))
+    return "\n".join(lines)
+
+
+def log_summary() -> None:
+    if _samples:
+        logger.info("Hot path timings (most recent %i calls per stage):\n%s", BUFFER_SIZE, format_summary())
+
+
+if ENABLED:
+    atexit.register(log_summary)
@@ -5,16 +5,14 @@ from psynet.demography.general import YearsOfFormalTraining, Age, Gender, Countr
 from psynet.page import InfoPage
 from psynet.timeline import join
 
+try:
+    from .static_html import static_html
+except ImportError:
+    from static_html import static_html
 
-def introduction(
-        time_estimate: float = 6
-) -> InfoPage:
-    """
-
-    :param time_estimate:
-    :return:
-    """
 
+@static_html
+def introduction_html():
     html = tags.div()
     with html:
         tags.h1(
@@ -32,7 +30,19 @@ def introduction(
             If you want, you will also be able to provide your email to be entered into the prize draw.
             """
         )
-    return InfoPage(html, time_estimate=time_estimate)
+    return html
+
+
+def introduction(
+        time_estimate: float = 6
+) -> InfoPage:
+    """
+
+    :param time_estimate:
+    :return:
+    """
+
+    return InfoPage(introduction_html(), time_estimate=time_estimate)
 
 def jazz_experience(
         time_estimate: float = 10
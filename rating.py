@@ -0,0 +1,201 @@
+import random
+
+from psynet.modular_page import SurveyJSControl
+
+
+class FrozenDict(dict):
+    """A dictionary that can't be modified after construction, but still serialises like a normal dictionary"""
+
+    def _read_only(self, *_, **__):
+        raise TypeError(f"{type(self).__name__} is read-only")
+
+    __setitem__ = __delitem__ = __ior__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+    def __reduce__(self):
+        # Pickling and copying would otherwise try to rebuild the dictionary using __setitem__
+        return type(self), (dict(self),)
+
+
+def freeze(obj):
+    """Recursively converts dictionaries to `FrozenDict`s and lists to tuples"""
+    if isinstance(obj, dict):
+        return FrozenDict((k, freeze(v)) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return tuple(freeze(v) for v in obj)
+    return obj
+
+
+# The rating questionnaire shown alongside every stimulus: this is built once, when the module is imported
+RATING_DESIGN = freeze({
+    "pages": [
+        {
+            "name": "page1",
+            "elements": [
+                {
+                    "type": "matrix",
+                    "name": "genre",
+                    "title": "Which genre best matches this performance?",
+                    "description": "Choose only one genre.",
+                    "isRequired": True,
+                    "columns": [
+                        {
+                            "value": "avantgardejazz",
+                            "text": "Avant-Garde"
+                        },
+                        {
+                            "value": "straightaheadjazz",
+                            "text": "Straight-Ahead"
+                        },
+                        {
+                            "value": "traditionalearlyjazz",
+                            "text": "Traditional & Early"
+                        }
+                    ],
+                    "rows": [
+                        {
+                            "value": "",
+                            "text": ""
+                        }
+                    ]
+                },
+                {
+                    "type": "rating",
+                    "name": "fit",
+                    "title": "How much does this performance sound like that genre?",
+                    "description": "Where a score of 5 means \"sounds exactly like\""
+                },
+                {
+                    "type": "matrix",
+                    "name": "preference",
+                    "title": "I like this performance.",
+                    "description": "Rate how strongly you agree or disagree with the statement for the performance.",
+                    "isRequired": True,
+                    "columns": [
+                        {
+                            "value": "1",
+                            "text": "Strongly dislike"
+                        },
+                        {
+                            "value": "2",
+                            "text": "Dislike"
+                        },
+                        {
+                            "value": "3",
+                            "text": "Neither like nor dislike"
+                        },
+                        {
+                            "value": "4",
+                            "text": "Like"
+                        },
+                        {
+                            "value": "5",
+                            "text": "Strongly like"
+                        }
+                    ],
+                    "rows": [
+                        {
+                            "value": "",
+                            "text": ""
+                        }
+                    ]
+                },
+                {
+                    "type": "matrix",
+                    "name": "diversity",
+                    "title": "The performance is creative.",
+                    "description": "Rate how strongly you agree or disagree with the statement for the performance.",
+                    "isRequired": True,
+                    "columns": [
+                        {
+                            "value": "1",
+                            "text": "Strongly disagree"
+                        },
+                        {
+                            "value": "2",
+                            "text": "Disagree"
+                        },
+                        {
+                            "value": "3",
+                            "text": "Neither agree nor disagree"
+                        },
+                        {
+                            "value": "4",
+                            "text": "Agree"
+                        },
+                        {
+                            "value": "5",
+                            "text": "Strongly agree"
+                        }
+                    ],
+                    "rows": [
+                        {
+                            "value": "",
+                            "text": ""
+                        }
+                    ]
+                },
+                {
+                    "type": "matrix",
+                    "name": "is_ml",
+                    "title": "The performance is generated with AI.",
+                    "description": "Rate how strongly you agree or disagree with the statement for the performance.",
+                    "isRequired": True,
+                    "columns": [
+                        {
+                            "value": "1",
+                            "text": "Strongly disagree"
+                        },
+                        {
+                            "value": "2",
+                            "text": "Disagree"
+                        },
+                        {
+                            "value": "3",
+                            "text": "Neither agree nor disagree"
+                        },
+                        {
+                            "value": "4",
+                            "text": "Agree"
+                        },
+                        {
+                            "value": "5",
+                            "text": "Strongly agree"
+                        }
+                    ],
+                    "rows": [
+                        {
+                            "value": "",
+                            "text": ""
+                        }
+                    ]
+                }
+            ]
+        }
+    ]
+})
+
+class RatingSurveyControl(SurveyJSControl):
+    """The rating questionnaire, rendered by PsyNet's own SurveyJS macro from the shared design.
+
+    Serialising the design once and embedding it through a custom macro was slower per page: importing the extra
+    template costs more than the `tojson` call it saves (see `benchmark.py rating`).
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(design=RATING_DESIGN, **kwargs)
+
+    def get_bot_response(self, *_, **__):
+        return rating_bot_response()
+
+
+def rating_bot_response() -> dict:
+    """A random answer to the rating questionnaire, in the format that SurveyJS submits"""
+    answer = {}
+    for element in RATING_DESIGN["pages"][0]["elements"]:
+        if element["type"] == "matrix":
+            # Matrix questions have a single unnamed row
+            answer[element["name"]] = {"null": random.choice(element["columns"])["value"]}
+        else:
+            answer[element["name"]] = random.randint(1, 5)
+    return answer
@@ -0,0 +1,176 @@
+"""Offline simulation of how the rating trial maker allocates nodes, to size recruitment batches.
+
+The allocation mirrors `RateTrialMaker` as configured in `experiment.py`: every trial goes to a node that isn't full
+(`target_trials_per_node` trials, counting those in progress), that the participant hasn't rated yet
+(`allow_repeated_nodes=False`), and that has the fewest trials so far (`balance_across_nodes=True`, ties broken at
+random). Participants arrive as a Poisson process and may drop out before any trial. Their trials are then failed
+(`fail_trials_on_premature_exit=True`) once the exit is noticed, which frees those places for later participants.
+
+Runs are simulated side by side: the state of every run is an array with one row per run, and the loop is over
+events (trial starts and exits) in time order within each run, so thousands of runs cost little more than one.
+"""
+
+import numpy as np
+import pandas as pd
+
+TRIALS_PER_PARTICIPANT = 15
+TARGET_TRIALS_PER_NODE = 15
+ARRIVALS_PER_HOUR = 30.0
+# Chance of leaving before each trial
+DROPOUT_RATE = 0.02
+# Time before the first trial (consent, requirements, calibration and instructions), and per trial (rating and
+# feedback pages), in seconds. Trial durations are log-normal around the median time taken in past exports
+SETUP_DURATION = 180.0
+TRIAL_DURATION = 45.0
+TRIAL_DURATION_SIGMA = 0.4
+# How long after leaving a participant's trials are failed, i.e. how long until the exit is noticed
+EXIT_DELAY = 15 * 60.0
+
+_FULL = 1 << 20    # added to the trial count of nodes that can't be allocated, to rule them out
+
+
+def simulate(
+        n_nodes: int,
+        n_runs: int = 1000,
+        trials_per_participant: int = TRIALS_PER_PARTICIPANT,
+        target_trials_per_node: int = TARGET_TRIALS_PER_NODE,
+        arrivals_per_hour: float = ARRIVALS_PER_HOUR,
+        dropout_rate: float = DROPOUT_RATE,
+        setup_duration: float = SETUP_DURATION,
+        trial_duration: float = TRIAL_DURATION,
+        exit_delay: float = EXIT_DELAY,
+        max_participants: int = None,
+        seed: int = None
+) -> dict:
+    """Simulates `n_runs` recruitment runs of the trial maker over `n_nodes` nodes.
+
+    Returns per-run arrays: `participants_needed` (the arrival number of the last participant whose trials were
+    kept), `completion_time` (when the last trial finished, in hours) and `failed_trials`; and the per-node
+    arrays `kept_trials` and `failed_by_node` of shape (n_runs, n_nodes). Runs that don't fill every node within
+    `max_participants` have NaN for the participants needed and the completion time.
+    """
+    rng = np.random.default_rng(seed)
+    total = n_nodes * target_trials_per_node
+    if max_participants is None:
+        # Enough for the expected dropouts, with a wide margin
+        expected = total / trials_per_participant / (1 - dropout_rate) ** trials_per_participant
+        max_participants = int(2 * expected) + 10
+    n_runs, n_participants, n_trials = int(n_runs), int(max_participants), int(trials_per_participant)
+
+    arrivals = np.cumsum(rng.exponential(3600 / arrivals_per_hour, (n_runs, n_participants)), axis=1)
+    durations = trial_duration * rng.lognormal(0, TRIAL_DURATION_SIGMA, (n_runs, n_participants, n_trials))
+    ends = arrivals[:, :, None] + setup_duration + np.cumsum(durations, axis=2)
+    starts = ends - durations
+    # The number of trials each participant starts before leaving (all of them if they stay to the end)
+    stays = rng.random((n_runs, n_participants, n_trials)) >= dropout_rate
+    n_started = np.where(stays.all(axis=2), n_trials, np.argmin(stays, axis=2))
+    dropped = n_started < n_trials
+    exit_times = np.where(
+        dropped, np.take_along_axis(starts, n_started[:, :, None] % n_trials, axis=2)[:, :, 0] + exit_delay, np.inf
+    )
+
+    # Events: trial k of participant p is p * n_trials + k, and the exit of participant p is after all trials
+    times = np.concatenate([starts.reshape(n_runs, -1), exit_times], axis=1)
+    times[:, :-n_participants][~(np.arange(n_trials) < n_started[:, :, None]).reshape(n_runs, -1)] = np.inf
+    order = np.argsort(times, axis=1, kind="stable")
+    n_events = int(np.isfinite(times).sum(axis=1).max())
+
+    rows = np.arange(n_runs)
+    counts = np.zeros((n_runs, n_nodes), dtype=np.int64)
+    seen = np.zeros((n_runs, n_participants, n_nodes), dtype=bool)
+    allocated = np.full((n_runs, n_participants, n_trials), -1, dtype=np.int64)
+    finished = np.zeros((n_runs, n_participants), dtype=bool)    # left the trial maker, with no node left for them
+    failed_by_node = np.zeros((n_runs, n_nodes), dtype=np.int64)
+    for event in order[:, :n_events].T:
+        valid = np.isfinite(times[rows, event])
+        is_exit = event >= n_participants * n_trials
+        participant = np.where(is_exit, event - n_participants * n_trials, event // n_trials)
+
+        start = np.flatnonzero(valid & ~is_exit & ~finished[rows, participant])
+        if len(start):
+            p = participant[start]
+            score = counts[start] + _FULL * (seen[start, p] | (counts[start] >= target_trials_per_node))
+            node = np.argmin(score + rng.random(score.shape) * 0.5, axis=1)
+            available = score[np.arange(len(start)), node] < _FULL
+            finished[start[~available], p[~available]] = True
+            start, p, node = start[available], p[available], node[available]
+            counts[start, node] += 1
+            seen[start, p, node] = True
+            allocated[start, p, event[start] % n_trials] = node
+
+        leave = np.flatnonzero(valid & is_exit)
+        if len(leave):
+            nodes = allocated[leave, participant[leave]]
+            run, trial = np.nonzero(nodes >= 0)
+            np.subtract.at(counts, (leave[run], nodes[run, trial]), 1)
+            np.add.at(failed_by_node, (leave[run], nodes[run, trial]), 1)
+
+    kept = (allocated >= 0) & ~dropped[:, :, None]
+    complete = counts.sum(axis=1) == total
+    contributed = kept.any(axis=2)
+    participants_needed = np.where(
+        complete, n_participants - np.argmax(contributed[:, ::-1], axis=1), np.nan
+    )
+    completion_time = np.where(complete, np.where(kept, ends, -np.inf).max(axis=(1, 2)) / 3600, np.nan)
+    return {
+        "participants_needed": participants_needed,
+        "completion_time": completion_time,
+        "failed_trials": failed_by_node.sum(axis=1),
+        "kept_trials": counts,
+        "failed_by_node": failed_by_node,
+    }
+
+
+def summarise(results: dict, quantiles: tuple = (0.5, 0.9, 0.99)) -> pd.DataFrame:
+    """Quantiles of the participants needed, completion time (hours) and failed trials over the simulated runs"""
+    names = ["participants_needed", "completion_time", "failed_trials"]
+    table = pd.DataFrame(
+        {name: np.nanquantile(results[name], quantiles) for name in names}, index=pd.Index(quantiles, name="quantile")
+    )
+    table.loc["incomplete"] = np.isnan(results["participants_needed"]).mean()
+    return table
+
+
+def node_balance(results: dict, keys: list = None) -> pd.DataFrame:
+    """Per node, the mean number of trials kept and failed over the simulated runs"""
+    n_nodes = results["kept_trials"].shape[1]
+    return pd.DataFrame({
+        "kept_trials": results["kept_trials"].mean(axis=0),
+        "failed_trials": results["failed_by_node"].mean(axis=0),
+    }, index=pd.Index(keys or range(n_nodes), name="node"))
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Estimate how many participants to recruit by simulation")
+    parser.add_argument("--n-runs", type=int, default=1000)
+    parser.add_argument("--n-nodes", type=int, help="Number of nodes (by default, the stimuli in the catalogue)")
+    parser.add_argument("--arrivals-per-hour", type=float, default=ARRIVALS_PER_HOUR)
+    parser.add_argument("--dropout-rate", type=float, default=DROPOUT_RATE)
+    parser.add_argument("--exit-delay", type=float, default=EXIT_DELAY, help="Seconds until an exit is noticed")
+    parser.add_argument("--trial-duration", type=float, default=TRIAL_DURATION)
+    parser.add_argument("--nodes", action="store_true", help="Also print the balance of trials over the nodes")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    node_keys = None
+    if args.n_nodes is None:
+        from catalogue import load_catalogue
+
+        node_keys = list(load_catalogue())
+    start_time = time.perf_counter()
+    simulated = simulate(
+        len(node_keys) if node_keys else args.n_nodes,
+        n_runs=args.n_runs,
+        arrivals_per_hour=args.arrivals_per_hour,
+        dropout_rate=args.dropout_rate,
+        trial_duration=args.trial_duration,
+        exit_delay=args.exit_delay,
+        seed=args.seed
+    )
+    print(f"Simulated {args.n_runs} runs in {time.perf_counter() - start_time:.1f} s")
+    print(summarise(simulated).to_string())
+    if args.nodes:
+        print(node_balance(simulated, node_keys).to_string())
@@ -0,0 +1,89 @@
+import os
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+try:
+    from .catalogue import AUDIO_DIR
+except ImportError:
+    from catalogue import AUDIO_DIR
+
+CALIBRATION_AUDIO = "assets/calibration/output.mp3"
+RENDITION_DIR = "assets/renditions"
+
+# Name -> (file extension, ffmpeg output arguments). The original mp3 is always available as the top rendition
+RENDITIONS = {
+    "opus_64k": (".ogg", ["-c:a", "libopus", "-b:a", "64k"]),
+    "opus_128k": (".ogg", ["-c:a", "libopus", "-b:a", "128k"]),
+}
+
+# Downlink speed (Mbit/s, as measured by the browser on every page) below which each rendition is used,
+# from the smallest up. Chrome caps the measurement at 10 Mbit/s
+BANDWIDTH_THRESHOLDS = [
+    (2.0, "opus_64k"),
+    (5.0, "opus_128k"),
+]
+
+
+def rendition_path(source: str, name: str, rendition_dir: str = RENDITION_DIR) -> str:
+    """Where the given rendition of a source file lives, e.g. `assets/renditions/opus_64k/render/<name>.ogg`"""
+    extension, _ = RENDITIONS[name]
+    relative = os.path.relpath(os.path.splitext(source)[0], "assets")
+    return os.path.join(rendition_dir, name, relative + extension)
+
+
+def transcode(source: str, destination: str, arguments: list[str]) -> None:
+    """Transcodes one file with ffmpeg, writing to a temporary file first so that interrupted runs leave nothing behind"""
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    tmp_path = destination + f".{os.getpid()}.tmp" + os.path.splitext(destination)[1]
+    subprocess.run(
+        ["ffmpeg", "-nostdin", "-loglevel", "error", "-y", "-i", source, "-vn", *arguments, tmp_path],
+        check=True
+    )
+    os.replace(tmp_path, destination)
+
+
+def build_renditions(
+        audio_dir: str = AUDIO_DIR,
+        extra: tuple = (CALIBRATION_AUDIO,),
+        rendition_dir: str = RENDITION_DIR,
+        n_workers: int = None
+) -> int:
+    """Transcodes every render (and the calibration audio) into each rendition, skipping any that are up to date"""
+    if shutil.which("ffmpeg") is None:
+        raise RuntimeError("ffmpeg is needed to build the audio renditions, but it is not installed")
+    sources = [os.path.join(audio_dir, i) for i in sorted(os.listdir(audio_dir)) if i.endswith(".mp3")]
+    jobs = []
+    for source in [*sources, *extra]:
+        for name, (_, arguments) in RENDITIONS.items():
+            destination = rendition_path(source, name, rendition_dir)
+            if not os.path.exists(destination) or os.path.getmtime(destination) < os.path.getmtime(source):
+                jobs.append((source, destination, arguments))
+    # Each job is an ffmpeg process, so threads are enough to keep every core busy
+    with ThreadPoolExecutor(max_workers=n_workers or os.cpu_count()) as pool:
+        list(pool.map(lambda job: transcode(*job), jobs))
+    return len(jobs)
+
+
+def choose_rendition(download_speed: Optional[float]) -> Optional[str]:
+    """Returns the rendition to send at the given downlink speed, or None for the original mp3"""
+    if download_speed is None:
+        return None
+    for threshold, name in BANDWIDTH_THRESHOLDS:
+        if download_speed < threshold:
+            return name
+    return None
+
+
+def get_download_speed(participant) -> Optional[float]:
+    """The downlink speed that the participant's browser reported with their last response"""
+    response = participant.last_response
+    if response is None or not response.metadata_:
+        return None
+    return response.metadata_.get("download_speed_megabits_per_sec")
+
+
+if __name__ == "__main__":
+    n_built = build_renditions()
+    print(f"Transcoded {n_built} renditions into {RENDITION_DIR}")
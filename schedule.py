@@ -0,0 +1,135 @@
+import hashlib
+import json
+import os
+import random
+from functools import lru_cache
+from typing import Optional
+
+try:
+    from .catalogue import load_catalogue
+except ImportError:
+    from catalogue import load_catalogue
+
+SCHEDULE_PATH = "assets/schedule.json"
+SCHEDULE_SEED = 42
+
+# Redis keys, namespaced by the digest of the schedule file: a counter of claimed blocks, and a queue of blocks given
+# back by participants who dropped out
+CLAIM_KEY = "rating_schedule:{digest}:next_block"
+RELEASED_KEY = "rating_schedule:{digest}:released"
+
+
+def build_schedule(stimuli: dict, block_size: int, n_cycles: int, seed: int = SCHEDULE_SEED) -> list[list[str]]:
+    """Splits the stimuli into blocks of `block_size`, such that each cycle of blocks uses every stimulus exactly once.
+
+    Within a cycle, stimuli are dealt round-robin from each genre x condition cell, with the order of the cells
+    rotated from round to round (as in the rows of a Latin square). Any run of `block_size` consecutive stimuli,
+    and so every block, therefore covers the cells as evenly as possible. Each cycle is shuffled differently.
+    """
+    if len(stimuli) % block_size != 0:
+        raise ValueError(f"Cannot split {len(stimuli)} stimuli into blocks of {block_size}")
+    cells = {}
+    for key, stimulus in sorted(stimuli.items()):
+        cells.setdefault((stimulus["genre"], stimulus["condition"]), []).append(key)
+    cells = list(cells.values())
+    rng = random.Random(seed)
+    blocks = []
+    for cycle in range(n_cycles):
+        shuffled = [rng.sample(cell, len(cell)) for cell in cells]
+        order = []
+        for position in range(max(len(cell) for cell in shuffled)):
+            for i in range(len(shuffled)):
+                cell = shuffled[(i + position + cycle) % len(shuffled)]
+                if position < len(cell):
+                    order.append(cell[position])
+        for start in range(0, len(order), block_size):
+            block = order[start:start + block_size]
+            # Shuffle within each block so that participants don't hear the cells in a predictable rotation
+            rng.shuffle(block)
+            blocks.append(block)
+    return blocks
+
+
+def write_schedule(
+        block_size: int,
+        n_cycles: int,
+        schedule_path: str = SCHEDULE_PATH,
+        seed: int = SCHEDULE_SEED,
+        deployment_id: str = None
+) -> list[list[str]]:
+    """Builds the schedule from the catalogue and writes it, so that it is deployed along with the experiment.
+
+    The deployment ID is written too, so that every deployment's schedule has its own digest and thus its own claims.
+    """
+    blocks = build_schedule(load_catalogue(), block_size, n_cycles, seed)
+    tmp_path = schedule_path + f".{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"block_size": block_size, "seed": seed, "deployment_id": deployment_id, "blocks": blocks}, f)
+    os.replace(tmp_path, schedule_path)
+    read_schedule.cache_clear()
+    reset_claims(schedule_path)
+    return blocks
+
+
+@lru_cache()
+def read_schedule(schedule_path: str = SCHEDULE_PATH) -> dict:
+    """The schedule file's contents, with the MD5 of the file as `digest`"""
+    with open(schedule_path, "rb") as f:
+        contents = f.read()
+    schedule = json.loads(contents)
+    schedule["digest"] = hashlib.md5(contents).hexdigest()
+    return schedule
+
+
+def load_schedule(schedule_path: str = SCHEDULE_PATH) -> list[list[str]]:
+    return read_schedule(schedule_path)["blocks"]
+
+
+def schedule_keys(schedule_path: str = SCHEDULE_PATH) -> tuple[str, str]:
+    """The claim counter and released-block queue of this schedule, so that claims from another never carry over"""
+    digest = read_schedule(schedule_path)["digest"]
+    return CLAIM_KEY.format(digest=digest), RELEASED_KEY.format(digest=digest)
+
+
+def reset_claims(schedule_path: str = SCHEDULE_PATH) -> None:
+    """Clears the claims on a schedule, if Redis can be reached (it can't when pre-deploying to a remote server)"""
+    from dallinger.db import redis_conn
+    from redis.exceptions import ConnectionError
+
+    try:
+        redis_conn.delete(*schedule_keys(schedule_path))
+    except ConnectionError:
+        pass
+
+
+def claim_block(schedule_path: str = SCHEDULE_PATH) -> Optional[int]:
+    """Atomically claims the next block, preferring blocks released by dropouts.
+
+    Returns None once every block has been claimed, as the nodes of a second round of claims would already be full.
+    """
+    from dallinger.db import redis_conn
+
+    claim_key, released_key = schedule_keys(schedule_path)
+    released = redis_conn.lpop(released_key)
+    if released is not None:
+        return int(released)
+    block = redis_conn.incr(claim_key) - 1
+    return block if block < len(load_schedule(schedule_path)) else None
+
+
+def release_block(block: int, schedule_path: str = SCHEDULE_PATH) -> None:
+    """Returns a block to the queue so that the next participant is given it instead of a new one"""
+    from dallinger.db import redis_conn
+
+    redis_conn.rpush(schedule_keys(schedule_path)[1], block)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Precompute the balanced schedule of rating blocks")
+    parser.add_argument("--block-size", type=int, default=15)
+    parser.add_argument("--n-cycles", type=int, default=15, help="How many times each stimulus is scheduled")
+    args = parser.parse_args()
+    written = write_schedule(args.block_size, args.n_cycles)
+    print(f"Wrote {len(written)} blocks of {args.block_size} stimuli to {SCHEDULE_PATH}")
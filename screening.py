@@ -0,0 +1,105 @@
+"""Data-quality screening of participants, run in bulk over an export.
+
+The export is decoded once into screening data: the analysis tables (see `tables.build_tables`), the event table of
+the `rating` trials (see `events.event_table`) and their timing metrics. Each rule is a function of that data which
+returns a boolean Series indexed by participant ID (True when the participant should be flagged), so new rules are
+added with the `rule` decorator and never read the export themselves.
+"""
+
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+
+try:
+    from .events import event_table, event_time, trial_metrics
+    from .export import EXPORT_PATH
+    from .tables import RATING_SCALES, build_tables, group_records
+except ImportError:
+    from events import event_table, event_time, trial_metrics
+    from export import EXPORT_PATH
+    from tables import RATING_SCALES, build_tables, group_records
+
+N_RATING_TRIALS = 15
+# Share of a participant's rating trials that may be submitted before the audio finished, e.g. after a playback glitch
+MAX_EARLY_SUBMIT_FRACTION = 0.2
+# The renders are about 16 s long, so a median below this means the participant rarely listened to the end
+MIN_MEDIAN_TIME_TAKEN = 15.0
+
+RULES = {}
+
+
+def rule(name: str) -> Callable:
+    """Registers a screening rule, a function of the screening data returning a boolean Series by participant ID"""
+    def register(fn: Callable) -> Callable:
+        RULES[name] = fn
+        return fn
+    return register
+
+
+def load_screening_data(path: str = EXPORT_PATH) -> dict:
+    """Decodes an export once into everything the rules need"""
+    grouped = group_records(path)
+    data = build_tables(path, grouped)
+    data["events"] = event_table(grouped["rating"])
+    data["trials"] = trial_metrics(data["events"])
+    return data
+
+
+def _participants(data: dict) -> pd.Index:
+    return pd.Index(np.unique(data["events"]["participant_id"]), name="participant_id")
+
+
+@rule("early_submit")
+def early_submit(data: dict) -> pd.Series:
+    """Submitted rating trials before `audioFinished: prompt` (or without it at all) too often"""
+    events = data["events"]
+    submitted = event_time(events, "trialConstruct") + events["time_taken"] * 1000
+    # NaN comparisons are False, so trials without an `audioFinished` event count as early
+    finished = submitted >= event_time(events, "audioFinished: prompt")
+    early = pd.Series(~finished, index=events["participant_id"])
+    return early.groupby(level=0).mean() > MAX_EARLY_SUBMIT_FRACTION
+
+
+@rule("too_fast")
+def too_fast(data: dict) -> pd.Series:
+    """Took implausibly little time over the typical rating trial"""
+    events = data["events"]
+    time_taken = pd.Series(events["time_taken"], index=events["participant_id"])
+    return time_taken.groupby(level=0).median() < MIN_MEDIAN_TIME_TAKEN
+
+
+@rule("straight_lining")
+def straight_lining(data: dict) -> pd.Series:
+    """Gave identical answers on every rating scale across all rating trials"""
+    grouped = data["rating"].groupby("participant_id")[RATING_SCALES]
+    identical = (grouped.nunique(dropna=False) == 1).all(axis=1)
+    return identical & (grouped.size() >= N_RATING_TRIALS)
+
+
+def screen(data: dict, rules: list[str] = None) -> pd.DataFrame:
+    """Runs the screening rules, giving one row per participant with a column per rule, `flagged` and `reasons`"""
+    participants = _participants(data)
+    flags = pd.DataFrame(
+        {name: RULES[name](data).reindex(participants, fill_value=False).astype(bool) for name in rules or RULES},
+        index=participants
+    )
+    names = np.array(flags.columns)
+    flags["flagged"] = flags.any(axis=1)
+    flags["reasons"] = [", ".join(names[row]) for row in flags[names].to_numpy()]
+    return flags
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Flag participants whose data fail the quality checks")
+    parser.add_argument("path", nargs="?", default=EXPORT_PATH)
+    parser.add_argument("--rules", nargs="+", choices=list(RULES))
+    parser.add_argument("--out", help="Write the flag table to this CSV file")
+    args = parser.parse_args()
+    table = screen(load_screening_data(args.path), args.rules)
+    if args.out:
+        table.to_csv(args.out)
+    print(table.to_string())
+    print(f"{table['flagged'].sum()} of {len(table)} participants flagged")
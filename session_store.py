@@ -0,0 +1,199 @@
+"""Compact binary store of an export's responses, grouped into participant sessions.
+
+Layout: an 8-byte magic, the header length (uint32), a JSON header, then 8-byte aligned arrays. Each top-level field
+is stored as a column: IDs and creation times (in seconds) as offsets from their minimum, in the narrowest integer
+type that fits, and every other field dictionary-encoded (codes into a table of its distinct values). The free-form
+fields of each participant's session (`answer`, `metadata_`, `vars`) are stored as one zlib block, compressed against
+a dictionary of the fragments that recur across sessions. Rows are sorted by participant and then trial order, so a
+session is one contiguous slice of every column.
+"""
+
+import collections
+import json
+import mmap
+import re
+import zlib
+from typing import Iterable
+
+import numpy as np
+
+try:
+    from .export import EXPORT_PATH, decode_records, iter_records
+except ImportError:
+    from export import EXPORT_PATH, decode_records, iter_records
+
+MAGIC = b"PSNSESS1"
+SESSION_FIELDS = ("answer", "metadata_", "vars")
+INTEGER_FIELDS = ("id", "participant_id")
+TIME_FIELD = "creation_time"
+TIME_FORMAT = re.compile(r"^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}$")
+ZDICT_SIZE = 32 * 1024    # zlib only looks back 32 KB, so a longer dictionary would be wasted
+
+
+def _dumps(obj) -> str:
+    return json.dumps(obj, separators=(",", ":"))
+
+
+def build_zdict(sessions: Iterable[list], size: int = ZDICT_SIZE) -> bytes:
+    """Builds a zlib dictionary from the metadata fragments that occur in more than one response"""
+    counts = collections.Counter()
+    for session in sessions:
+        for _, metadata, _ in session:
+            for key, value in (metadata or {}).items():
+                if key == "event_log":
+                    # Event times are unique, but the rest of each event recurs
+                    counts.update(_dumps(event)[:-30] for event in value)
+                else:
+                    counts[_dumps({key: value})[1:-1]] += 1
+    # zlib finds matches near the end of the dictionary most cheaply, so the most common fragments go last
+    fragments = sorted((count, fragment) for fragment, count in counts.items() if count > 1)
+    return "".join(fragment for _, fragment in fragments).encode()[-size:]
+
+
+def _unsigned_dtype(max_value: int) -> type:
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if max_value <= np.iinfo(dtype).max:
+            return dtype
+    return np.uint64
+
+
+def _compress(data: bytes, zdict: bytes) -> bytes:
+    compressor = zlib.compressobj(9, zdict=zdict)
+    return compressor.compress(data) + compressor.flush()
+
+
+def write_session_store(records: Iterable[dict], path: str) -> None:
+    """Writes decoded export records (see `export.decode_record`) to a session store"""
+    records = sorted(records, key=lambda r: (int(r["participant_id"]), r.get(TIME_FIELD) or "", int(r["id"])))
+    fields = [f for f in dict.fromkeys(k for r in records for k in r) if f not in SESSION_FIELDS]
+    participant_ids = np.array([int(r["participant_id"]) for r in records], dtype=np.int64)
+    participants, row_starts = np.unique(participant_ids, return_index=True)
+    row_offsets = np.append(row_starts, len(records))
+
+    arrays, columns = [], {}
+    for field in fields:
+        values = [r.get(field) for r in records]
+        if field in INTEGER_FIELDS or (
+                field == TIME_FIELD and all(isinstance(v, str) and TIME_FORMAT.match(v) for v in values)
+        ):
+            if field == TIME_FIELD:
+                numbers = np.array(values, dtype="datetime64[s]").astype(np.int64)
+            else:
+                numbers = np.array([int(v) for v in values], dtype=np.int64)
+            # Stored as offsets from the smallest value, which usually fit in a much narrower type
+            base = int(numbers.min())
+            columns[field] = {"kind": "time" if field == TIME_FIELD else "int", "base": base}
+            arrays.append((field, (numbers - base).astype(_unsigned_dtype(int(numbers.max()) - base))))
+        else:
+            table, codes = {}, []
+            for value in values:
+                codes.append(table.setdefault(value, len(table)))
+            columns[field] = {"kind": "codes", "values": list(table)}
+            # A field with a single value needs no codes at all
+            if len(table) > 1:
+                arrays.append((field, np.array(codes, dtype=_unsigned_dtype(len(table) - 1))))
+
+    sessions = [
+        [[r.get(f) for f in SESSION_FIELDS] for r in records[start:end]]
+        for start, end in zip(row_offsets[:-1], row_offsets[1:])
+    ]
+    zdict = build_zdict(sessions)
+    blocks = [_compress(_dumps(session).encode(), zdict) for session in sessions]
+    block_offsets = np.concatenate([[0], np.cumsum([len(b) for b in blocks])]).astype(np.int64)
+    arrays += [
+        ("participants", participants),
+        ("row_offsets", row_offsets.astype(np.int64)),
+        ("block_offsets", block_offsets),
+        ("zdict", np.frombuffer(zlib.compress(zdict, 9), dtype=np.uint8)),
+        ("blocks", np.frombuffer(b"".join(blocks), dtype=np.uint8)),
+    ]
+
+    # Array offsets are relative to the end of the header, which is padded so that every array stays aligned
+    layout, position = {}, 0
+    for name, array in arrays:
+        layout[name] = {"dtype": array.dtype.str, "offset": position, "length": len(array)}
+        position += -(-array.nbytes // 8) * 8
+    header = _dumps({"n_rows": len(records), "fields": fields, "columns": columns, "arrays": layout}).encode()
+    header += b" " * (-(len(MAGIC) + 4 + len(header)) % 8)
+    with open(path, "wb") as f:
+        f.write(MAGIC + np.uint32(len(header)).tobytes() + header)
+        for _, array in arrays:
+            f.write(array.tobytes())
+            f.write(b"\0" * (-array.nbytes % 8))
+
+
+class SessionStore:
+    """Memory-maps a session store, reading columns and single sessions without loading the rest of the file"""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a session store")
+        header_length = int(np.frombuffer(self._mmap, dtype=np.uint32, count=1, offset=len(MAGIC))[0])
+        data_start = len(MAGIC) + 4 + header_length
+        header = json.loads(bytes(self._mmap[len(MAGIC) + 4:data_start]))
+        self.n_rows, self.fields, self.columns = header["n_rows"], header["fields"], header["columns"]
+        self._arrays = {
+            name: np.frombuffer(self._mmap, dtype=spec["dtype"], count=spec["length"], offset=data_start + spec["offset"])
+            for name, spec in header["arrays"].items()
+        }
+        self.participants = self._arrays["participants"]
+        self._zdict = zlib.decompress(self._arrays["zdict"].tobytes())
+
+    def column(self, field: str, rows: slice = slice(None)) -> list:
+        """Returns the values of one field, as they appear in the export, for all (or some) rows"""
+        spec = self.columns[field]
+        if spec["kind"] == "codes" and field not in self._arrays:
+            return spec["values"] * len(range(self.n_rows)[rows])
+        array = self._arrays[field][rows]
+        if spec["kind"] == "int":
+            return [str(v) for v in array.astype(np.int64) + spec["base"]]
+        if spec["kind"] == "time":
+            times = (array.astype(np.int64) + spec["base"]).astype("datetime64[s]")
+            return [t.replace("T", " ") for t in np.datetime_as_string(times)]
+        values = spec["values"]
+        return [values[code] for code in array]
+
+    def _index(self, participant_id) -> int:
+        i = int(np.searchsorted(self.participants, int(participant_id)))
+        if i == len(self.participants) or self.participants[i] != int(participant_id):
+            raise KeyError(participant_id)
+        return i
+
+    def session(self, participant_id) -> list[dict]:
+        """Returns one participant's decoded responses in trial order, reading only their rows and block"""
+        i = self._index(participant_id)
+        row_offsets, block_offsets = self._arrays["row_offsets"], self._arrays["block_offsets"]
+        rows = slice(int(row_offsets[i]), int(row_offsets[i + 1]))
+        block = self._arrays["blocks"][block_offsets[i]:block_offsets[i + 1]].tobytes()
+        decompressor = zlib.decompressobj(zdict=self._zdict)
+        session = json.loads(decompressor.decompress(block) + decompressor.flush())
+        columns = {field: self.column(field, rows) for field in self.fields}
+        return [
+            {**{field: columns[field][j] for field in self.fields}, **dict(zip(SESSION_FIELDS, values))}
+            for j, values in enumerate(session)
+        ]
+
+    def __iter__(self):
+        for participant_id in self.participants:
+            yield from self.session(participant_id)
+
+    def close(self) -> None:
+        # The arrays point into the memory map, so they have to go before it can be closed
+        self._arrays.clear()
+        self.participants = None
+        self._mmap.close()
+
+
+if __name__ == "__main__":
+    import argparse
+    import os
+
+    parser = argparse.ArgumentParser(description="Convert an export to a compact session store")
+    parser.add_argument("path", nargs="?", default=EXPORT_PATH)
+    parser.add_argument("--out", default="sessions.bin")
+    args = parser.parse_args()
+    write_session_store(decode_records(iter_records(args.path)), args.out)
+    size, store_size = os.path.getsize(args.path), os.path.getsize(args.out)
+    print(f"{args.path}: {size} bytes -> {args.out}: {store_size} bytes ({size / store_size:.1f}x smaller)")
@@ -0,0 +1,13 @@
+import functools
+
+from markupsafe import Markup
+
+
+def static_html(build):
+    """Decorator for functions that build the same dominate tree for every participant.
+
+    The tree is rendered to HTML on the first call and later calls return the cached fragment, which PsyNet serves
+    as is. The cache lasts as long as the process, so an edited page is picked up on the next restart.
+    """
+    render = functools.cache(lambda: Markup(build().render()))
+    return functools.wraps(build)(render)
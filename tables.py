@@ -0,0 +1,190 @@
+import importlib.util
+import os
+import re
+from typing import Iterable
+
+import pandas as pd
+
+try:
+    from .catalogue import CATALOGUE_PATH, read_catalogue
+    from .export import EXPORT_PATH, decode_record, iter_records
+except ImportError:
+    from catalogue import CATALOGUE_PATH, read_catalogue
+    from export import EXPORT_PATH, decode_record, iter_records
+
+GENRES = ["avantgardejazz", "straightaheadjazz", "traditionalearlyjazz"]
+RATING_SCALES = ["fit", "preference", "diversity", "is_ml"]
+STIMULUS_FIELDS = ["condition_token", "similarity", "condition_type", "track_fpath"]
+
+# Labels of the questionnaire pages. The prize draw email is deliberately left out of the analysis tables
+QUESTIONNAIRE_QUESTIONS = [
+    "age",
+    "gender",
+    "country_of_birth",
+    "country_of_residence",
+    "years_of_formal_training",
+    "hours_of_daily_music_listening",
+    "money_from_playing_music",
+    "jazz_experience",
+    "recognise_feedback",
+    "similarity_feedback",
+    "feedback",
+]
+
+# Questionnaire answers that are numbers. All other answers are free text and are never converted
+NUMERIC_QUESTIONS = ["age", "years_of_formal_training", "hours_of_daily_music_listening"]
+
+# Parquet needs pyarrow, which the experiment itself doesn't, so without it tables are pickled (keeping their dtypes)
+TABLE_EXTENSION = ".parquet" if importlib.util.find_spec("pyarrow") else ".pkl"
+
+_NODE_ID = re.compile(r"/node_(\d+)__")
+
+
+def _matrix_value(value):
+    """SurveyJS matrix questions have a single unnamed row, so their answers are nested under a `null` key"""
+    if isinstance(value, dict):
+        return next(iter(value.values()), None)
+    return value
+
+
+def _response_columns(records: list) -> dict:
+    """Columns shared by every table: response ID, participant ID, creation time and page timing"""
+    return {
+        "response_id": pd.array([int(r["id"]) for r in records], dtype="int32"),
+        "participant_id": pd.array([int(r["participant_id"]) for r in records], dtype="int32"),
+        "creation_time": pd.to_datetime([r["creation_time"] for r in records]),
+        "time_taken": pd.array([r["metadata_"].get("time_taken") for r in records], dtype="float32"),
+    }
+
+
+def rating_table(records: Iterable[dict]) -> pd.DataFrame:
+    """Flattens decoded `rating` responses into one typed row per trial, joined with the stimulus metadata"""
+    records = list(records)
+    prompts = [r["metadata_"].get("prompt", {}) for r in records]
+    answers = [r["answer"] or {} for r in records]
+    columns = _response_columns(records)
+    node_ids = [_NODE_ID.search(p.get("url") or "") for p in prompts]
+    columns["node_id"] = pd.array([int(m.group(1)) if m else None for m in node_ids], dtype="Int32")
+    columns["download_speed"] = pd.array(
+        [r["metadata_"].get("download_speed_megabits_per_sec") for r in records], dtype="float32"
+    )
+    # Renders are named e.g. `avantgardejazz_001_clamp.mid.mp3`
+    stimuli = [(p.get("track_fpath") or "__").split(".")[0].split("_") for p in prompts]
+    columns["stimulus"] = pd.Categorical(["_".join(s) if all(s) else None for s in stimuli])
+    columns["stimulus_genre"] = pd.Categorical([s[0] or None for s in stimuli], categories=GENRES)
+    columns["stimulus_num"] = pd.array([int(s[1]) if s[1] else None for s in stimuli], dtype="Int16")
+    columns["stimulus_condition"] = pd.Categorical([s[2] or None for s in stimuli])
+    for field in STIMULUS_FIELDS:
+        values = [p.get(field) for p in prompts]
+        columns[field] = pd.array(values, dtype="float32") if field == "similarity" else pd.Categorical(values)
+    columns["genre"] = pd.Categorical([_matrix_value(a.get("genre")) for a in answers], categories=GENRES)
+    for scale in RATING_SCALES:
+        values = [_matrix_value(a.get(scale)) for a in answers]
+        columns[scale] = pd.array([None if v is None else int(v) for v in values], dtype="Int8")
+    table = pd.DataFrame(columns)
+    table["genre_correct"] = (table["genre"] == table["stimulus_genre"]).astype("boolean")
+    return table
+
+
+def feedback_table(records: Iterable[dict]) -> pd.DataFrame:
+    """Flattens decoded `listening_feedback` responses, keeping the feedback text shown for each stimulus"""
+    records = list(records)
+    columns = _response_columns(records)
+    columns["text"] = pd.Categorical([r["metadata_"].get("prompt", {}).get("text") for r in records])
+    return pd.DataFrame(columns)
+
+
+def questionnaire_table(records: Iterable[dict]) -> pd.DataFrame:
+    """Flattens decoded questionnaire responses into one row per participant and question"""
+    records = list(records)
+    columns = _response_columns(records)
+    columns["question"] = pd.Categorical([r["question"] for r in records], categories=QUESTIONNAIRE_QUESTIONS)
+    columns["answer"] = pd.array([None if r["answer"] is None else str(r["answer"]) for r in records], dtype="string")
+    table = pd.DataFrame(columns)
+    numeric = table["question"].isin(NUMERIC_QUESTIONS)
+    table["answer_number"] = pd.to_numeric(table["answer"].where(numeric), errors="coerce").astype("Float32")
+    return table
+
+
+def stimulus_table(stimuli: dict) -> pd.DataFrame:
+    """Flattens catalogue entries (see `catalogue.read_catalogue`) into one row per stimulus with its full metadata.
+
+    Nodes only carry the few metadata fields that the trials need, so the rest is joined from here (on `stimulus`).
+    """
+    table = pd.json_normalize([stimulus["metadata"] for stimulus in stimuli.values()])
+    table.insert(0, "stimulus", pd.Categorical(list(stimuli)))
+    return table
+
+
+def join_stimuli(table: pd.DataFrame, stimuli: pd.DataFrame) -> pd.DataFrame:
+    """Adds the metadata of each row's stimulus to a table, skipping fields that the table already has"""
+    stimuli = stimuli[[c for c in stimuli.columns if c == "stimulus" or c not in table.columns]]
+    return table.merge(stimuli.astype({"stimulus": str}), on="stimulus", how="left", validate="many_to_one")
+
+
+TABLES = {
+    "rating": (["rating"], rating_table),
+    "listening_feedback": (["listening_feedback"], feedback_table),
+    "questionnaire": (QUESTIONNAIRE_QUESTIONS, questionnaire_table),
+}
+
+
+def group_records(path: str = EXPORT_PATH) -> dict[str, list]:
+    """Decodes the records of every table in a single streaming pass, grouped by table"""
+    by_question = {question: name for name, (questions, _) in TABLES.items() for question in questions}
+    grouped = {name: [] for name in TABLES}
+    for record in iter_records(path, question=by_question):
+        grouped[by_question[record["question"]]].append(decode_record(record))
+    return grouped
+
+
+def build_tables(
+        path: str = EXPORT_PATH,
+        grouped: dict[str, list] = None,
+        stimuli: dict = None
+) -> dict[str, pd.DataFrame]:
+    """Builds every table from an export in a single streaming pass (or from records already grouped).
+
+    Given the catalogue entries, also builds the `stimuli` table of their full metadata.
+    """
+    grouped = group_records(path) if grouped is None else grouped
+    tables = {name: TABLES[name][1](grouped[name]) for name in TABLES}
+    if stimuli is not None:
+        tables["stimuli"] = stimulus_table(stimuli)
+    return tables
+
+
+def table_path(out_dir: str, name: str) -> str:
+    return os.path.join(out_dir, name + TABLE_EXTENSION)
+
+
+def write_tables(tables: dict[str, pd.DataFrame], out_dir: str) -> None:
+    """Writes each table to `<out_dir>/<name>.parquet`, or to `<name>.pkl` if pyarrow isn't installed"""
+    os.makedirs(out_dir, exist_ok=True)
+    for name, table in tables.items():
+        if TABLE_EXTENSION == ".parquet":
+            table.to_parquet(table_path(out_dir, name), index=False)
+        else:
+            table.to_pickle(table_path(out_dir, name))
+
+
+def read_table(out_dir: str, name: str, columns: list[str] = None) -> pd.DataFrame:
+    """Reads one table (optionally only some of its columns) written by `write_tables`"""
+    if TABLE_EXTENSION == ".parquet":
+        return pd.read_parquet(table_path(out_dir, name), columns=columns)
+    table = pd.read_pickle(table_path(out_dir, name))
+    return table if columns is None else table[columns]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Convert an export to typed tables (Parquet if pyarrow is installed)")
+    parser.add_argument("path", nargs="?", default=EXPORT_PATH)
+    parser.add_argument("--out-dir", default="tables")
+    parser.add_argument("--catalogue", default=CATALOGUE_PATH, help="Catalogue to build the stimuli table from")
+    args = parser.parse_args()
+    built = build_tables(args.path, stimuli=read_catalogue(args.catalogue) if os.path.exists(args.catalogue) else None)
+    write_tables(built, args.out_dir)
+    for table_name, built_table in built.items():
+        print(f"{table_name}: {len(built_table)} rows -> {table_path(args.out_dir, table_name)}")
@@ -3,6 +3,8 @@
 # To run this test via Docker, run the following in your terminal:
 #
 # bash docker/run pytest test.py
+#
+# and once more with SCHEDULED_ALLOCATION=1 in front, to test the scheduled allocation of stimuli.
 
 # You can customize the behavior of the automated tests by overriding certain methods within
 # your experiment class, located in experiment.py:
@@ -29,3 +31,16 @@ def test_experiment(launched_experiment):
     # or editing your PyCharm run configuration to add `--tb=short` to your additional
     # arguments. This should ensure that the full traceback is printed.
     launched_experiment.test_experiment()
+
+
+LOAD_TEST_BOTS = int(os.environ.get("LOAD_TEST_BOTS") or 0)
+
+
+@pytest.mark.skipif(not LOAD_TEST_BOTS, reason="set LOAD_TEST_BOTS to the number of concurrent bots to run")
+@pytest.mark.parametrize("experiment_directory", [experiment_dir], indirect=True)
+def test_load(launched_experiment):
+    from loadtest import format_report, run_load_test
+
+    report = run_load_test(LOAD_TEST_BOTS)
+    print(format_report(report))
+    assert not report["errors"]